@@ -1,8 +1,9 @@
+from dissect.cstruct.addrspace import AddressSpace, FileAddressSpace, PagedAddressSpace
 from dissect.cstruct.compiler import Compiler
 from dissect.cstruct.expression import Expression
 from dissect.cstruct.types.base import Array, BaseType, RawType
 from dissect.cstruct.types.chartype import CharType
-from dissect.cstruct.types.instance import Instance
+from dissect.cstruct.types.instance import CompiledInstance, Instance, LazyInstance
 from dissect.cstruct.types.structure import Structure, Field, Union
 from dissect.cstruct.types.voidtype import VoidType
 from dissect.cstruct.types.wchartype import WcharType
@@ -10,13 +11,14 @@ from dissect.cstruct.types.packedtype import PackedType
 from dissect.cstruct.types.flag import Flag, FlagInstance
 from dissect.cstruct.types.enum import Enum, EnumInstance
 from dissect.cstruct.types.bytesinteger import BytesInteger
-from dissect.cstruct.types.pointer import Pointer, PointerInstance
+from dissect.cstruct.types.pointer import Pointer, PointerCache, PointerInstance
 
 from dissect.cstruct.exceptions import (
     Error,
     ParserError,
     ResolveError,
     NullPointerDereference,
+    AddressError,
 )
 
 from dissect.cstruct.cstruct import (
@@ -27,20 +29,30 @@ from dissect.cstruct.cstruct import (
 from dissect.cstruct.utils import (
     dumpstruct,
     hexdump,
+    structure_dtype,
+    wrap_enum,
 )
 
+from dissect.cstruct.traverse import traverse
+
 from dissect.cstruct.bitbuffer import BitBuffer
 
 __all__ = [
+    "AddressSpace",
+    "FileAddressSpace",
+    "PagedAddressSpace",
     "Compiler",
     "Array",
     "Union",
     "Field",
     "Instance",
+    "CompiledInstance",
+    "LazyInstance",
     "Structure",
     "Expression",
     "PackedType",
     "Pointer",
+    "PointerCache",
     "PointerInstance",
     "VoidType",
     "WcharType",
@@ -57,8 +69,12 @@ __all__ = [
     "ctypes",
     "dumpstruct",
     "hexdump",
+    "structure_dtype",
+    "wrap_enum",
+    "traverse",
     "Error",
     "ParserError",
     "ResolveError",
     "NullPointerDereference",
+    "AddressError",
 ]
@@ -0,0 +1,169 @@
+"""Address spaces that pointers are dereferenced through.
+
+By default, pointers are dereferenced by seeking the stream they were read from
+to their address. That only works if addresses are offsets in that stream. An
+address space translates addresses instead, for example the virtual addresses
+of a memory image to offsets in the image, or the addresses of the segments of
+a sparse dump to offsets in the dump file.
+"""
+import io
+from collections import OrderedDict
+
+from dissect.cstruct.exceptions import AddressError
+
+
+class AddressSpace(object):
+    """Base class of address spaces, subclasses implement read()."""
+
+    def read(self, addr, size):
+        """Read size bytes at an address.
+
+        Less bytes are returned if the end of the address space, or an unmapped
+        address after the first one, is reached.
+
+        Raises:
+            AddressError: If the address isn't mapped.
+        """
+        raise NotImplementedError()
+
+    def open(self, addr=0):
+        """Return a file-like object that reads this address space, positioned at the given address."""
+        return AddressSpaceStream(self, addr)
+
+
+class AddressSpaceStream(object):
+    """Read-only file-like object on top of an address space.
+
+    Args:
+        space: The address space to read.
+        addr: The address to start reading at.
+    """
+
+    def __init__(self, space, addr=0):
+        self.space = space
+        self.addr = addr
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            raise ValueError("Address spaces can only be read in chunks of a known size")
+
+        data = self.space.read(self.addr, size)
+        self.addr += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.addr = offset
+        elif whence == io.SEEK_CUR:
+            self.addr += offset
+        else:
+            raise ValueError("Address spaces have no end to seek relative to")
+
+        return self.addr
+
+    def tell(self):
+        return self.addr
+
+    def seekable(self):
+        return True
+
+
+class FileAddressSpace(AddressSpace):
+    """Address space in which addresses are offsets in a file-like object.
+
+    Args:
+        fh: The file-like object to read from.
+    """
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def read(self, addr, size):
+        self.fh.seek(addr)
+        return self.fh.read(size)
+
+
+class PagedAddressSpace(AddressSpace):
+    """Address space that translates addresses page by page and caches the pages that are read.
+
+    The translate function is called with the address of a page, and returns the
+    offset of that page in the file-like object or None if the page isn't mapped.
+    The least recently used pages are evicted when the cache is full. For example,
+    a sparse dump with a list of (address, offset, size) segments could use:
+
+        def translate(addr):
+            for start, offset, size in segments:
+                if start <= addr < start + size:
+                    return offset + addr - start
+            return None
+
+    Args:
+        fh: The file-like object to read pages from.
+        translate: Function to translate the address of a page to an offset.
+        page_size: The size of pages, a power of two.
+        cache_size: The maximum number of pages in the cache.
+    """
+
+    def __init__(self, fh, translate, page_size=0x1000, cache_size=1024):
+        if page_size <= 0 or page_size & (page_size - 1):
+            raise ValueError("Invalid page size: %r" % page_size)
+
+        self.fh = fh
+        self.translate = translate
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self._pages = OrderedDict()
+
+    def read(self, addr, size):
+        result = []
+        end = addr + size
+
+        while addr < end:
+            page_addr = addr & ~(self.page_size - 1)
+            try:
+                page = self.page(page_addr)
+            except AddressError:
+                if not result:
+                    raise
+
+                # The data ends at an unmapped page
+                break
+
+            start = addr - page_addr
+            chunk = page[start:min(len(page), end - page_addr)]
+            result.append(chunk)
+            addr += len(chunk)
+
+            if start + len(chunk) < self.page_size:
+                # The page is truncated at the end of the file
+                break
+
+        return b''.join(result)
+
+    def page(self, page_addr):
+        """Return the data of the page at the given page aligned address.
+
+        Raises:
+            AddressError: If the page isn't mapped.
+        """
+        page = self._pages.get(page_addr)
+        if page is not None:
+            self._pages.move_to_end(page_addr)
+            return page
+
+        offset = self.translate(page_addr)
+        if offset is None:
+            raise AddressError("Address not mapped: 0x%x" % page_addr)
+
+        self.fh.seek(offset)
+        page = self.fh.read(self.page_size)
+
+        self._pages[page_addr] = page
+        if len(self._pages) > self.cache_size:
+            self._pages.popitem(last=False)
+
+        return page
+
+    def clear(self):
+        """Remove all pages from the cache."""
+        self._pages.clear()
@@ -0,0 +1,260 @@
+import hashlib
+import importlib.util
+import io
+import marshal
+import os
+import pickle
+import stat
+import sys
+import tempfile
+import warnings
+
+from dissect.cstruct.compiler import Compiler
+
+_library_hash = None
+
+
+def library_hash():
+    """Return a hash of the library sources and the Python version.
+
+    Cached definitions contain marshalled code objects and pickled types, which
+    are only valid for the exact library and interpreter that created them.
+    """
+    global _library_hash
+
+    if _library_hash is None:
+        digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        digest.update(sys.version.encode())
+
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for root, dirs, files in os.walk(package_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    with open(os.path.join(root, name), 'rb') as fh:
+                        digest.update(fh.read())
+
+        _library_hash = digest.hexdigest()
+
+    return _library_hash
+
+
+def _load_compiled(cstruct, structure_name, code, refs, structure, source):
+    code_object = marshal.loads(code)
+    cls = Compiler(cstruct).load_code(structure_name, code_object, refs)
+
+    compiled = cls(cstruct, structure, source)
+    cstruct._compiled_types.add(compiled)
+    return compiled
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler for the types of a cstruct instance.
+
+    The cstruct instance and all types that existed before the definitions were loaded
+    are stored as a reference. Compiled structures are stored as their marshalled code.
+    """
+
+    def __init__(self, file, cstruct, existing):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.cstruct = cstruct
+        self.existing = existing
+
+    def persistent_id(self, obj):
+        if obj is self.cstruct:
+            return ('cstruct',)
+
+        if id(obj) in self.existing:
+            return ('type', self.existing[id(obj)])
+
+        return None
+
+    def reducer_override(self, obj):
+        cls = obj.__class__
+        if getattr(cls, '_code', None) is None or obj not in self.cstruct._compiled_types:
+            return NotImplemented
+
+        return _load_compiled, (
+            obj.cstruct,
+            cls.__name__,
+            marshal.dumps(cls._code),
+            cls._refs,
+            obj.structure,
+            obj.source,
+        )
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, cstruct):
+        super().__init__(file)
+        self.cstruct = cstruct
+
+    def persistent_load(self, pid):
+        if pid == ('cstruct',):
+            return self.cstruct
+
+        if pid[0] == 'type':
+            return self.cstruct.typedefs[pid[1]]
+
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}")
+
+
+class DefinitionCache(object):
+    """On-disk cache of the types that result from loading definitions.
+
+    A cache entry holds everything a load adds to a cstruct instance: types,
+    constants and lookups, with compiled structures stored as marshalled code.
+    Entries are keyed by the definition, the load options, the state of the
+    cstruct instance and the library version, so a changed input results in a
+    cache miss instead of a stale result.
+
+    Cache entries are unpickled, so anyone who can write to the directory can run
+    code in the process that loads them. The directory must be trusted: it isn't
+    used if it's owned by another user, or writable by its group or by others.
+
+    Args:
+        cstruct: The cstruct instance to load definitions into.
+        path: The directory to store cache entries in.
+    """
+
+    def __init__(self, cstruct, path):
+        self.cstruct = cstruct
+        self.path = path
+
+    def key(self, definition, deftype, kwargs):
+        """Return the cache key for loading a definition with the given options."""
+        cs = self.cstruct
+        digest = hashlib.sha256(library_hash().encode())
+
+        for part in (
+            cs.endian,
+            repr(cs.pointer),
+            repr(cs.align),
+            repr(cs.track_sizes),
+            repr(cs.lazy),
+            repr(cs.keep_raw),
+            repr(cs.array_type),
+            repr(cs.raw_enums),
+            repr(deftype),
+            repr(sorted(kwargs.items())),
+            repr(sorted((name, _describe(value)) for name, value in cs.typedefs.items())),
+            repr(sorted(cs.consts.items(), key=lambda item: item[0])),
+            repr(sorted(cs.lookups)),
+            definition,
+        ):
+            digest.update(part.encode('utf-8', 'surrogatepass'))
+            digest.update(b'\x00')
+
+        return digest.hexdigest()
+
+    def snapshot(self):
+        """Capture the state of the cstruct instance before loading definitions."""
+        cs = self.cstruct
+        return dict(cs.typedefs), dict(cs.consts), dict(cs.lookups)
+
+    def load(self, key):
+        """Load a cache entry into the cstruct instance.
+
+        Returns:
+            Whether the entry existed and was loaded.
+        """
+        if not self.trusted():
+            return False
+
+        try:
+            with open(self._entry_path(key), 'rb') as fh:
+                state = _Unpickler(fh, self.cstruct).load()
+        except Exception:
+            # A missing, corrupt or incompatible entry is a miss, it's (over)written afterwards
+            return False
+
+        cs = self.cstruct
+        cs.typedefs.update(state['typedefs'])
+        cs.consts.update(state['consts'])
+        cs.lookups.update(state['lookups'])
+        cs._anonymous_count = state['anonymous_count']
+        return True
+
+    def store(self, key, snapshot):
+        """Store everything that was loaded since the given snapshot.
+
+        Definitions that can't be pickled, e.g. because of custom types, aren't cached.
+        """
+        cs = self.cstruct
+        typedefs, consts, lookups = snapshot
+
+        existing = {}
+        for name, value in typedefs.items():
+            if not isinstance(value, str):
+                existing.setdefault(id(value), name)
+
+        state = {
+            'typedefs': _changes(typedefs, cs.typedefs),
+            'consts': _changes(consts, cs.consts),
+            'lookups': _changes(lookups, cs.lookups),
+            'anonymous_count': cs._anonymous_count,
+        }
+
+        buf = io.BytesIO()
+        try:
+            _Pickler(buf, cs, existing).dump(state)
+        except Exception:
+            return False
+
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        if not self.trusted():
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(buf.getvalue())
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return False
+
+        return True
+
+    def trusted(self):
+        """Return whether the cache directory can be trusted to only contain entries of the current user.
+
+        Directories that don't exist aren't trusted. On platforms without file
+        ownership, every existing directory is trusted.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+
+        if not hasattr(os, 'getuid'):
+            return True
+
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            warnings.warn(
+                "Not using cache directory %r, it isn't owned by the current user or is writable by others" % self.path
+            )
+            return False
+
+        return True
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+
+def _describe(value):
+    """Describe a typedef for the cache key, by its type and size, or by the name of the type it aliases."""
+    if isinstance(value, str):
+        return value
+
+    try:
+        size = len(value)
+    except TypeError:
+        size = None
+
+    return '{}:{!r}:{}'.format(value.__class__.__name__, value, size)
+
+
+def _changes(before, after):
+    return {k: v for k, v in after.items() if k not in before or before[k] is not v}
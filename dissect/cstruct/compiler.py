@@ -1,19 +1,71 @@
+import keyword
+import re
 import struct
 from collections import OrderedDict
+from io import BytesIO
 from dissect.cstruct.bitbuffer import BitBuffer
 from dissect.cstruct.expression import Expression
-from dissect.cstruct.types.base import Array
+from dissect.cstruct.types.base import Array, read_null_terminated
 from dissect.cstruct.types.chartype import CharType
-from dissect.cstruct.types.instance import Instance
+from dissect.cstruct.types.instance import CompiledInstance, EnumField, Instance, LazyInstance, RawEnumInstance
 from dissect.cstruct.types.structure import Structure, Union
 from dissect.cstruct.types.wchartype import WcharType
-from dissect.cstruct.types.packedtype import PackedType
+from dissect.cstruct.types.packedtype import ARRAY_TYPECODES, PackedType
 from dissect.cstruct.types.flag import Flag, FlagInstance
 from dissect.cstruct.types.enum import Enum, EnumInstance
 from dissect.cstruct.types.bytesinteger import BytesInteger
 from dissect.cstruct.types.pointer import Pointer, PointerInstance
 
 
+STATIC_READ_TEMPLATE = """
+    def _read_array(self, stream, count):
+        size = max(0, count) * {size:d}
+        buf = stream.read(size)
+        if len(buf) != size: raise EOFError()
+        return [{getter} for data in {struct_ref}.iter_unpack(buf)]
+
+    def read_from(self, buffer, offset=0):
+        try:
+            data = {struct_ref}.unpack_from(buffer, offset)
+        except struct.error:
+            raise EOFError("Read past the end of the buffer at offset %d" % offset)
+        return {getter}, offset + {size:d}
+"""
+
+LAZY_READ_TEMPLATE = """
+    def _read_array(self, stream, count):
+        size = max(0, count) * {size:d}
+        buf = stream.read(size)
+        if len(buf) != size: raise EOFError()
+        return [LazyInstance(self, buf, offset) for offset in range(0, size, {size:d})]
+
+    def read_from(self, buffer, offset=0):
+        end = offset + {size:d}
+        if offset < 0 or memoryview(buffer).nbytes < end:
+            raise EOFError("Read past the end of the buffer at offset %d" % offset)
+        return LazyInstance(self, buffer, offset), end
+"""
+
+WRITE_TEMPLATE = """
+    def dumps(self, data):
+        if getattr(data, '_raw', None) is not None:
+            raw = self._dumps_raw(data)
+            if raw is not None:
+                return raw
+
+        try:
+{write_code}
+        except struct.error:
+            # Values that don't fit the static layout, e.g. arrays of a different size
+            out = BytesIO()
+            Structure._write(self, out, data)
+            return out.getvalue()
+
+    def _write(self, stream, data):
+        return stream.write(self.dumps(data))
+"""
+
+
 class Compiler(object):
     """Compiler for cstruct structures. Creates somewhat optimized parsing code."""
 
@@ -30,44 +82,72 @@ class Compiler(object):
     )
 
     COMPILE_TEMPLATE = """
-class {name}(Structure):
+{structs}
+
+class {name}({base}):
     def __init__(self, cstruct, structure, source=None):
         self.structure = structure
         self.source = source
         super().__init__(cstruct, structure.name, structure.fields, anonymous=structure.anonymous)
 
     def _read(self, stream):
-        r = OrderedDict()
-        sizes = {{}}
-        bitreader = BitBuffer(stream, self.cstruct.endian)
-
 {read_code}
-
-        return Instance(self, r, sizes)
-
+{static_code}{write_code}
     def add_field(self, name, type_, offset=None):
         raise NotImplementedError("Can't add fields to a compiled structure")
 
     def __repr__(self):
-        return '<Structure {name} +compiled>'
+        return '<{base} {name} +compiled>'
 """
 
     def __init__(self, cstruct):
         self.cstruct = cstruct
+        self._formats = {}
+        self._refs = {}
+        self._sizes = {}
+        self._instances = {}
+        self._depth = 0
 
     def compile(self, structure):
-        if isinstance(structure, Union):
-            # TODO: Compiling unions should be supported
+        try:
+            source = self.gen_source(structure)
+        except TypeError:
             return structure
 
-        structure_name = structure.name
+        compiled = self._exec(structure.name, source)(self.cstruct, structure, source)
+        self.cstruct._compiled_types.add(compiled)
+
+        return compiled
 
+    def recompile(self, compiled):
+        """Regenerate the code of a compiled structure in place.
+
+        The generated code is specialized for the endianness of the cstruct instance,
+        so it has to be regenerated when that changes.
+        """
         try:
-            # Generate struct class based on provided structure type
-            source = self.gen_struct_class(structure_name, structure)
+            source = self.gen_source(compiled.structure)
         except TypeError:
-            return structure
+            return
+
+        compiled.__class__ = self._exec(compiled.structure.name, source)
+        compiled.source = source
+
+    def gen_source(self, structure):
+        """Generate the source of the compiled class for a structure or union."""
+        self._formats = {}
+        self._refs = {}
+        self._sizes = {}
+        self._instances = {}
+        self._depth = 0
 
+        # Generate struct class based on provided structure type
+        if isinstance(structure, Union):
+            return self.gen_union_class(structure.name, structure)
+
+        return self.gen_struct_class(structure.name, structure)
+
+    def _exec(self, structure_name, source):
         # Create code object that can be executed later on
         code_object = compile(
             source,
@@ -75,81 +155,240 @@ class {name}(Structure):
             'exec',
         )
 
+        return self.load_code(structure_name, code_object, dict(self._refs.values()))
+
+    def load_code(self, structure_name, code_object, refs):
+        """Execute the code of a compiled structure and return the resulting class.
+
+        The code object and the types it refers to are kept on the class, so that
+        the class can be recreated without generating the code again.
+
+        Args:
+            structure_name: The name of the generated class.
+            code_object: The compiled code of the generated source.
+            refs: A dict of the names and types that the code refers to.
+        """
         env = {
             'OrderedDict': OrderedDict,
             'Structure': Structure,
+            'Union': Union,
+            'BytesIO': BytesIO,
             'Instance': Instance,
-            'Expression': Expression,
+            'CompiledInstance': CompiledInstance,
+            'RawEnumInstance': RawEnumInstance,
+            'EnumField': EnumField,
+            'LazyInstance': LazyInstance,
             'EnumInstance': EnumInstance,
             'FlagInstance': FlagInstance,
             'PointerInstance': PointerInstance,
             'BytesInteger': BytesInteger,
             'BitBuffer': BitBuffer,
+            'CharType': CharType,
             'struct': struct,
             'range': range,
+            'read_null_terminated': read_null_terminated,
         }
+        env.update(refs)
 
         exec(code_object, env)
-        return env[structure_name](self.cstruct, structure, source)
+
+        cls = env[structure_name]
+        cls._code = code_object
+        cls._refs = refs
+        return cls
+
+    def _struct_ref(self, fmt):
+        """Return the name of the precompiled struct.Struct for the given format."""
+        if fmt not in self._formats:
+            self._formats[fmt] = '_struct_{:d}'.format(len(self._formats))
+
+        return self._formats[fmt]
+
+    def _type_ref(self, type_):
+        """Return the name under which the given type is available to the compiled code."""
+        if id(type_) not in self._refs:
+            self._refs[id(type_)] = ('_type_{:d}'.format(len(self._refs)), type_)
+
+        return self._refs[id(type_)][0]
+
+    @property
+    def _wchar_encoding(self):
+        return 'utf-16-le' if self.cstruct.endian == '<' else 'utf-16-be'
+
+    def _format_template(self, **kwargs):
+        structs = ''.join(
+            '{} = struct.Struct({!r})\n'.format(name, self.cstruct.endian + fmt)
+            for fmt, name in self._formats.items()
+        )
+        structs += ''.join('{} = {}\n'.format(name, sizes) for sizes, name in self._sizes.items())
+        structs += ''.join(
+            self._gen_instance_class(name, names, enums, class_name)
+            for name, names, enums, class_name in self._instances.values() if name
+        )
+        return self.COMPILE_TEMPLATE.format(structs=structs, **kwargs)
+
+    def _sizes_ref(self, sizes):
+        """Return the name of a constant dict with the given static field sizes."""
+        code = '{{{}}}'.format(', '.join('"{}": {:d}'.format(name, size) for name, size in sizes))
+        if code not in self._sizes:
+            self._sizes[code] = '_sizes_{:d}'.format(len(self._sizes))
+
+        return self._sizes[code]
+
+    def _instance_ref(self, structure):
+        """Return the name to create instances of the generated instance class of a structure with.
+
+        Returns None if the names of the fields can't be used as slots, instances
+        of the structure then use the generic instance class.
+        """
+        if id(structure) not in self._instances:
+            names = list(_field_names(self.cstruct, structure.fields))
+            enums = {}
+            if self.cstruct.raw_enums:
+                # The raw values of enum fields are kept in separate slots, behind a descriptor
+                enums = {name: self._type_ref(enum) for name, enum in structure._enum_fields().items()}
+
+            slots = names + ['_raw_' + name for name in enums]
+            name = '_instance_{:d}'.format(len(self._instances)) if _is_slots(slots) else None
+            class_name = '{}_Instance'.format(re.sub(r'\W', '_', structure.name))
+            self._instances[id(structure)] = (name, names, enums, class_name)
+
+        name = self._instances[id(structure)][0]
+        return None if name is None else name + '_init'
+
+    def _gen_instance_class(self, name, names, enums, class_name):
+        # Assignments to instances are tracked, which is too slow while reading. The values are
+        # set through a subclass with plain attribute assignment instead, which then turns the
+        # new object into an instance of the actual class.
+        # The classes are named after the structure, the generated name only refers to them in the code.
+        slots = tuple('_raw_' + field_name if field_name in enums else field_name for field_name in names)
+        code = [
+            '\n',
+            'class {}(CompiledInstance):'.format(name),
+            '    __slots__ = {!r}'.format(slots),
+            '    _fields = {!r}'.format(tuple(names)),
+            '',
+            '',
+            'class {0}_init({0}):'.format(name),
+            '    __slots__ = ()',
+            '    __setattr__ = object.__setattr__',
+            '',
+            '    def __init__(self, _type, _sizes{}):'.format(''.join(', ' + field_name for field_name in names)),
+            '        self._type = _type',
+            '        self._sizes = _sizes',
+            '        self._dirty = None',
+            '        self._raw = None',
+        ]
+        code.extend('        self.{} = {}'.format(slot, field_name) for slot, field_name in zip(slots, names))
+        code.append('        self.__class__ = {}'.format(name))
+        code.append('')
+        code.append('')
+        code.append('{0}.__name__ = {0}.__qualname__ = {1!r}'.format(name, class_name))
+        code.append('{0}_init.__name__ = {0}_init.__qualname__ = {1!r}'.format(name, class_name + '_init'))
+        code.extend(
+            '{0}.{1} = EnumField({0}._raw_{1}, {2})'.format(name, field_name, type_ref)
+            for field_name, type_ref in enums.items()
+        )
+        return '\n'.join(code) + '\n'
+
+    def _generic_instance(self, structure):
+        """Return the name of the generic instance class to use for a structure without a generated one."""
+        if self.cstruct.raw_enums and structure._enum_fields():
+            return 'RawEnumInstance'
+
+        return 'Instance'
+
+    def gen_instance(self, structure, type_ref):
+        """Generate the code that creates the instance at the end of _read()."""
+        name = self._instance_ref(structure)
+        if name is None:
+            return '{}({}, r, sizes)'.format(self._generic_instance(structure), type_ref)
+
+        names = self._instances[id(structure)][1]
+        return '{}({}, sizes{})'.format(name, type_ref, ''.join(', r["{}"]'.format(n) for n in names))
 
     def gen_struct_class(self, name, structure):
+        if self.cstruct.lazy and structure._lazy_layout():
+            return self.gen_lazy_class(name, structure)
+
         blocks = []
         classes = []
         cur_block = []
-        read_size = 0
         prev_was_bits = False
 
-        for field in structure.fields:
+        for i, field in enumerate(structure.fields):
             field_type = self.cstruct.resolve(field.type)
 
             if not isinstance(field_type, self.TYPES):
                 raise TypeError(f"Unsupported type for compiler: {field_type}")
 
+            # The names that are available to expressions
+            names = set(_field_names(self.cstruct, structure.fields[:i]))
+
             if isinstance(field_type, Structure) \
                     or (isinstance(field_type, Array) and isinstance(field_type.type, Structure)):
 
-                blocks.append(self.gen_read_block(read_size, cur_block))
+                if self._is_static(field):
+                    # Statically sized structures are decoded inline
+                    cur_block.append(field)
+                    continue
+
+                if cur_block:
+                    blocks.append(self.gen_read_block(cur_block))
 
-                struct_read = 's = stream.tell()\n'
+                struct_read = self._gen_tell()
                 if isinstance(field_type, Array):
                     num = field_type.count
 
                     if isinstance(num, Expression):
-                        num = 'max(0, Expression(self.cstruct, "{expr}").evaluate(r))'.format(expr=num.expression)
+                        num = 'max(0, {})'.format(self.gen_expression(num, names))
+
+                    bulk_read = self.gen_bulk_array_read(field.name, field_type.type, num)
+                    if bulk_read:
+                        blocks.append(bulk_read)
+                        cur_block = []
+                        continue
 
                     struct_read += (
-                        'r["{name}"] = []\n'
-                        'for _ in range({num}):\n'
-                        '    r["{name}"].append(self.lookup["{name}"].type.type._read(stream))\n'.format(
+                        'r["{name}"] = {type_ref}._read_array(stream, {num})'.format(
                             name=field.name,
                             num=num,
+                            type_ref=self._type_ref(field_type.type),
                         )
                     )
-                    struct_read += 'sizes["{name}"] = stream.tell() - s'.format(name=field.name)
+                    struct_read += self._gen_size(field.name, 'stream.tell() - s')
                 elif isinstance(field_type, Structure) and field_type.anonymous:
-                    struct_read += 'v = self.lookup["{name}"].type._read(stream)\n'.format(name=field.name)
-                    struct_read += 'r.update(v._values)\n'
-                    struct_read += 'sizes.update(v._sizes)'
+                    struct_read += 'v = {}._read(stream)\n'.format(self._type_ref(field_type))
+                    struct_read += 'r.update(v._values)'
+                    if self.cstruct.track_sizes:
+                        struct_read += '\nsizes.update(v._sizes)'
                 else:
-                    struct_read += 'r["{name}"] = self.lookup["{name}"].type._read(stream)\n'.format(name=field.name)
-                    struct_read += 'sizes["{name}"] = stream.tell() - s'.format(name=field.name)
+                    struct_read += 'r["{name}"] = {type_ref}._read(stream)'.format(
+                        name=field.name,
+                        type_ref=self._type_ref(field_type),
+                    )
+                    struct_read += self._gen_size(field.name, 'stream.tell() - s')
 
                 blocks.append(struct_read)
-                read_size = 0
                 cur_block = []
                 continue
 
+            if field.bits and self._is_static(field):
+                # Bitfields of plain integer types are extracted from the unpacked storage unit
+                cur_block.append(field)
+                continue
+
             if field.bits:
-                blocks.append(self.gen_read_block(read_size, cur_block))
+                if cur_block:
+                    blocks.append(self.gen_read_block(cur_block))
                 blocks.append(
-                    'r["{name}"] = bitreader.read(self.cstruct.{type_name}, {bits})'.format(
+                    'r["{name}"] = bitreader.read({type_ref}, {bits})'.format(
                         name=field.name,
-                        type_name=field.type.name,
+                        type_ref=self._type_ref(field_type),
                         bits=field.bits
                     )
                 )
 
-                read_size = 0
                 cur_block = []
                 prev_was_bits = True
                 continue
@@ -159,250 +398,779 @@ class {name}(Structure):
                 prev_was_bits = False
 
             try:
-                count = len(field_type)
-                read_size += count
+                len(field_type)
                 cur_block.append(field)
             except TypeError:
                 if cur_block:
-                    blocks.append(self.gen_read_block(read_size, cur_block))
+                    blocks.append(self.gen_read_block(cur_block))
 
-                blocks.append(self.gen_dynamic_block(field))
-                read_size = 0
+                blocks.append(self.gen_dynamic_block(field, names))
                 cur_block = []
 
         if len(cur_block):
-            blocks.append(self.gen_read_block(read_size, cur_block))
-
-        read_code = '\n\n'.join(blocks)
-        read_code = '\n'.join(['    ' * 2 + line for line in read_code.split('\n')])
+            blocks.append(self.gen_read_block(cur_block))
 
         classes.append(
-            self.COMPILE_TEMPLATE.format(
+            self._format_template(
                 name=name,
-                read_code=read_code
+                base='Structure',
+                read_code=self.gen_read_code(blocks, self.gen_instance(structure, 'self')),
+                static_code=self.gen_static_read_code(structure),
+                write_code=self.gen_write_methods(structure),
             )
         )
         return '\n\n'.join(classes)
 
-    def gen_read_block(self, size, block):
-        template = (
+    def gen_lazy_class(self, name, structure):
+        """Generate the source of a compiled structure that is read lazily.
+
+        Reading only keeps the bytes of the structure, the values are decoded by
+        the LazyInstance when they are accessed.
+        """
+        size = len(structure)
+        read_code = (
+            'buf = stream.read({size:d})\n'
+            'if len(buf) != {size:d}: raise EOFError()\n'
+            '\n'
+            'return LazyInstance(self, buf)'.format(size=size)
+        )
+
+        if isinstance(structure, Union):
+            return self._format_template(
+                name=name,
+                base='Union',
+                read_code=_indent(read_code, 2),
+                static_code=LAZY_READ_TEMPLATE.format(size=size),
+                write_code='',
+            )
+
+        return self._format_template(
+            name=name,
+            base='Structure',
+            read_code=_indent(read_code, 2),
+            static_code=LAZY_READ_TEMPLATE.format(size=size),
+            write_code=self.gen_write_methods(structure),
+        )
+
+    def gen_read_code(self, blocks, instance):
+        """Generate the body of _read() from the given blocks of code."""
+        prologue = (
+            'r = OrderedDict()\n'
+            'sizes = {sizes}\n'
+            'bitreader = BitBuffer(stream, {endian!r})'.format(
+                sizes='{}' if self.cstruct.track_sizes else 'None',
+                endian=self.cstruct.endian,
+            )
+        )
+        epilogue = 'return ' + instance
+
+        if self.cstruct.keep_raw:
+            prologue = 'start = stream.tell()\n' + prologue
+            epilogue = (
+                'end = stream.tell()\n'
+                'stream.seek(start)\n'
+                'return {}._with_raw(stream.read(end - start))'.format(instance)
+            )
+
+        return _indent('\n\n'.join([prologue] + blocks + [epilogue]), 2)
+
+    def gen_write_methods(self, structure):
+        """Generate the dumps() and _write() methods, or nothing if writing can't be compiled."""
+        try:
+            write_code = self.gen_write_code(structure)
+        except TypeError:
+            # Writing falls back to the interpreted implementation
+            return ''
+
+        return WRITE_TEMPLATE.format(write_code=_indent(write_code, 3))
+
+    def gen_static_read_code(self, structure):
+        """Generate the read methods that are specific to statically sized structures.
+
+        These are a _read_array() that reads all elements of an array at once and a
+        read_from() that decodes directly from a buffer with unpack_from(). Other
+        structures use the generic implementations of these methods.
+        """
+        if self.cstruct.keep_raw:
+            # The generic implementations go through _read(), which keeps the raw bytes
+            return ''
+
+        try:
+            fmt, _, getter = self._gen_instance(structure, 'self', 0, 'data')
+        except TypeError:
+            return ''
+
+        if not fmt:
+            return ''
+
+        return STATIC_READ_TEMPLATE.format(size=len(structure), getter=getter, struct_ref=self._struct_ref(fmt))
+
+    def gen_bulk_array_read(self, name, type_, num):
+        """Generate the code that reads an array of statically sized structures with a single read.
+
+        Returns:
+            The generated code, or None if the elements can't be decoded statically.
+        """
+        item_type = self.cstruct.resolve(type_)
+        if isinstance(item_type, Union) or (self.cstruct.lazy and item_type._lazy_layout()):
+            return None
+
+        try:
+            fmt, _, getter = self._gen_instance(item_type, self._type_ref(item_type), 0, 'data')
+        except TypeError:
+            return None
+
+        if not fmt:
+            return None
+
+        return (
+            'dynsize = {num}\n'
+            'buf = stream.read(dynsize * {size:d})\n'
+            'if len(buf) != dynsize * {size:d}: raise EOFError()\n'
+            'r["{name}"] = [{getter} for data in {struct_ref}.iter_unpack(buf)]'.format(
+                num=num,
+                size=len(item_type),
+                name=name,
+                getter=getter,
+                struct_ref=self._struct_ref(fmt),
+            )
+            + self._gen_size(name, 'dynsize * {:d}'.format(len(item_type)))
+        )
+
+    def _gen_tell(self):
+        """Generate the code that records the start of a field, to determine its size."""
+        return 's = stream.tell()\n' if self.cstruct.track_sizes else ''
+
+    def _gen_size(self, name, size):
+        """Generate the code that records the size of a field, if sizes are tracked."""
+        if not self.cstruct.track_sizes or size is None:
+            return ''
+
+        return '\nsizes["{}"] = {}'.format(name, size)
+
+    def _is_typed_array(self, item_type):
+        """Return whether arrays of the given type are decoded into the configured array type."""
+        if self.cstruct.array_type == 'numpy':
+            return isinstance(item_type, PackedType) or (isinstance(item_type, BytesInteger) and item_type.size <= 8)
+
+        if self.cstruct.array_type == 'list' or not isinstance(item_type, PackedType):
+            return False
+
+        return ARRAY_TYPECODES.get(item_type.packchar) is not None
+
+    def _is_static(self, field):
+        """Return whether a field can be decoded as part of a static block."""
+        try:
+            len(field.type)
+            self._gen_entries([field], 0, 'data', 'r')
+        except TypeError:
+            return False
+
+        return True
+
+    def gen_union_class(self, name, structure):
+        """Generate the source of a compiled union.
+
+        All members of a union start at the beginning of the same buffer, so the
+        full union is read with a single read and every member is decoded from it.
+        """
+        if self.cstruct.lazy and structure._lazy_layout():
+            return self.gen_lazy_class(name, structure)
+
+        size = len(structure)
+        blocks = [
             'buf = stream.read({size})\n'
-            'if len(buf) != {size}: raise EOFError()\n'
-            'data = struct.unpack(self.cstruct.endian + "{{}}", buf)\n'
-            '{{}}'.format(size=size)
+            'if len(buf) != {size}: raise EOFError()'.format(size=size)
+        ]
+
+        for field in structure.fields:
+            field_type = self.cstruct.resolve(field.type)
+
+            if not isinstance(field_type, self.TYPES):
+                raise TypeError(f"Unsupported type for compiler: {field_type}")
+
+            if field.bits:
+                raise TypeError("Bitfields in unions are not supported by the compiler")
+
+            if not self._is_static(field):
+                member_read = 'v = {}._read(BytesIO(buf))\n'.format(self._type_ref(field_type))
+                if isinstance(field_type, Structure) and field_type.anonymous:
+                    member_read += 'r.update(v._values)'
+                    if self.cstruct.track_sizes:
+                        member_read += '\nsizes.update(v._sizes)'
+                else:
+                    member_read += 'r["{name}"] = v'.format(name=field.name)
+                    member_read += self._gen_size(field.name, len(field_type))
+
+                blocks.append(member_read)
+                continue
+
+            blocks.append(self.gen_unpack_block([field]))
+
+        return self._format_template(
+            name=name,
+            base='Union',
+            read_code=self.gen_read_code(blocks, self.gen_instance(structure, 'self')),
+            static_code='',
+            write_code='',
         )
 
-        read_code = []
-        fmt = []
+    def gen_write_code(self, structure):
+        """Generate the body of dumps() for a structure.
 
-        cur_type = None
-        cur_count = 0
+        Consecutive fields with a static size are packed with a single struct.pack call,
+        everything else is delegated to the field type.
+        """
+        code = []
+        parts = []
+        fmt = []
+        args = []
+        bits_unit = None
 
-        buf_offset = 0
-        data_offset = 0
+        def flush():
+            if fmt:
+                parts.append('{}.pack({})'.format(self._struct_ref(''.join(fmt)), ', '.join(args)))
+                fmt.clear()
+                args.clear()
 
-        for field in block:
+        for i, field in enumerate(structure.fields):
             field_type = self.cstruct.resolve(field.type)
-            read_type = field_type
+            value = _attr('data', field.name)
+            tmp = 'v{:d}'.format(i)
 
-            count = 1
-            data_count = 1
+            if field.bits:
+                if not isinstance(field_type, PackedType) or field_type.packchar in 'fd':
+                    raise TypeError(f"Unsupported bitfield type for compiler: {field_type}")
 
-            if isinstance(read_type, (Enum, Flag)):
-                read_type = read_type.type
-            elif isinstance(read_type, Pointer):
-                read_type = self.cstruct.pointer
+                if bits_unit is None or bits_unit[1] < 1 or bits_unit[0].size != field_type.size:
+                    bits_unit = [field_type, field_type.size * 8, []]
+                    fmt.append(field_type.packchar.upper())
+                    args.append(None)
 
-            if isinstance(field_type, Array):
-                count = read_type.count
-                data_count = count
-                read_type = read_type.type
-
-                if isinstance(read_type, (Enum, Flag)):
-                    read_type = read_type.type
-                elif isinstance(read_type, Pointer):
-                    read_type = self.cstruct.pointer
-
-                if isinstance(read_type, (CharType, WcharType, BytesInteger)):
-                    read_slice = '{}:{}'.format(
-                        buf_offset, buf_offset + (count * read_type.size)
-                    )
+                unit_type, remaining, values = bits_unit
+                if field.bits > remaining:
+                    raise TypeError(f"Bitfield {field.name} overflows its storage unit")
+
+                if self.cstruct.endian != '>':
+                    shift = unit_type.size * 8 - remaining
                 else:
-                    read_slice = '{}:{}'.format(data_offset, data_offset + count)
-            elif isinstance(read_type, CharType):
-                read_slice = f'{buf_offset}:{buf_offset + 1}'
-            elif isinstance(read_type, (WcharType, BytesInteger)):
-                read_slice = '{}:{}'.format(buf_offset, buf_offset + read_type.size)
+                    shift = remaining - field.bits
+
+                values.append('({} & {:#x}) << {:d}'.format(value, (1 << field.bits) - 1, shift))
+                bits_unit[1] -= field.bits
+                args[-1] = ' | '.join(values)
+                continue
+
+            bits_unit = None
+
+            if isinstance(field_type, Array):
+                count = field_type.count
+                item_type = self.cstruct.resolve(field_type.type)
+                if field_type.dynamic or field_type.null_terminated or isinstance(item_type, Structure):
+                    count = None
+            elif isinstance(field_type, Structure):
+                count = None
+                item_type = field_type
             else:
-                read_slice = str(data_offset)
+                count = 1
+                item_type = field_type
+
+            if count is None:
+                # Dynamic or nested, let the type itself handle it
+                flush()
+                if isinstance(field_type, Structure) and field_type.anonymous:
+                    value = 'data'
+                parts.append('{}.dumps({})'.format(self._type_ref(field_type), value))
+                continue
+
+            is_array = isinstance(field_type, Array)
+            if is_array and isinstance(item_type, PackedType) and self._is_typed_array(item_type):
+                # Array objects are copied as a whole, lists fall back to struct.pack()
+                code.append('{} = {}.pack_array({})'.format(tmp, self._type_ref(item_type), value))
+                code.append('if len({}) != {:d}: raise struct.error()'.format(tmp, count * item_type.size))
+                fmt.append('{:d}s'.format(count * item_type.size))
+                args.append(tmp)
+                continue
 
-            if not cur_type:
-                if isinstance(read_type, PackedType):
-                    cur_type = read_type.packchar
+            if isinstance(item_type, (Enum, Flag)):
+                if is_array:
+                    value = '[d.value if isinstance(d, EnumInstance) else d for d in {}]'.format(value)
                 else:
-                    cur_type = 'x'
+                    code.append('{} = {}'.format(tmp, value))
+                    code.append('if isinstance({tmp}, EnumInstance): {tmp} = {tmp}.value'.format(tmp=tmp))
+                    value = tmp
+                item_type = item_type.type
+
+            if isinstance(item_type, PackedType):
+                fmt.append('{:d}{}'.format(count, item_type.packchar))
+                args.append('*' + value if is_array else value)
+                continue
+
+            if isinstance(item_type, CharType):
+                code.append('{} = {}'.format(tmp, value))
+                code.append('if {tmp}.__class__ is not bytes: {tmp} = CharType.pack({tmp})'.format(tmp=tmp))
+            elif isinstance(item_type, WcharType):
+                code.append('{} = {}.encode({!r})'.format(tmp, value, self._wchar_encoding))
+            elif isinstance(item_type, BytesInteger):
+                if not is_array:
+                    value = '[{}]'.format(value)
+                code.append('{} = BytesInteger.pack({}, {:d}, {!r})'.format(
+                    tmp, value, item_type.size, self.cstruct.endian
+                ))
+            else:
+                raise TypeError(f"Unsupported type for compiler: {item_type}")
+
+            size = count * item_type.size
+            code.append('if len({}) != {:d}: raise struct.error()'.format(tmp, size))
+            fmt.append('{:d}s'.format(size))
+            args.append(tmp)
+
+        flush()
+
+        if not parts:
+            code.append("return b''")
+        elif len(parts) == 1:
+            code.append('return {}'.format(parts[0]))
+        else:
+            code.append("return b''.join([")
+            code.extend('    {},'.format(part) for part in parts)
+            code.append('])')
+
+        return '\n'.join(code)
+
+    def gen_read_block(self, block):
+        """Generate the code that reads and decodes the statically sized fields in block."""
+        fmt, _, _ = self._gen_entries(block, 0, 'data', 'r')
+        size = struct.calcsize(self.cstruct.endian + fmt)
+
+        template = (
+            'buf = stream.read({size})\n'
+            'if len(buf) != {size}: raise EOFError()\n'
+            '{{}}'.format(size=size)
+        )
+        return template.format(self.gen_unpack_block(block))
+
+    def gen_unpack_block(self, block):
+        """Generate the code that decodes the fields in block from the bytes in buf."""
+        fmt, _, entries = self._gen_entries(block, 0, 'data', 'r')
+
+        read_code = []
+        for name, getter, size in entries:
+            read_code.append('r["{}"] = {}'.format(name, getter) + self._gen_size(name, size))
+
+        if not fmt:
+            return '\n'.join(read_code)
 
-            if isinstance(read_type, (PackedType, CharType, WcharType, BytesInteger, Enum, Flag)):
-                char_count = count
+        return 'data = {}.unpack_from(buf)\n{}'.format(self._struct_ref(fmt), '\n'.join(read_code))
 
-                if isinstance(read_type, (CharType, WcharType, BytesInteger)):
-                    data_count = 0
-                    pack_char = 'x'
-                    char_count *= read_type.size
+    def _gen_entries(self, fields, index, data, ctx):
+        """Generate the getters of statically sized fields.
+
+        The fields are decoded from the tuple data, which results from unpacking
+        the returned format, starting at index.
+
+        Args:
+            fields: The fields to generate getters for.
+            index: The index in data of the first field. Either an int or code.
+            data: The name of the tuple to decode from.
+            ctx: The name of the dict with the values read so far, used as context for pointers.
+
+        Runs of bitfields sharing a storage unit are unpacked as a single integer,
+        from which every field is extracted with a constant shift and mask. The
+        storage units are laid out the same way as BitBuffer.read() does.
+
+        Returns:
+            A tuple of the struct format, the number of items it unpacks to and
+            a list of (name, getter, size) tuples. The size of bitfields is None.
+
+        Raises:
+            TypeError: If the fields can't be decoded statically.
+        """
+        fmt = []
+        entries = []
+        count = 0
+        unit_type = None
+        unit_item = None
+        remaining = 0
+
+        for field in fields:
+            field_type = self.cstruct.resolve(field.type)
+
+            if field.bits:
+                if not isinstance(field_type, PackedType) or field_type.packchar in 'efd':
+                    raise TypeError(f"Unsupported bitfield type for compiler: {field_type}")
+
+                if unit_type is not None and remaining > 0 and unit_type != field_type \
+                        and unit_type.size == field_type.size:
+                    # Structure._calc_offsets() starts a new unit here, BitBuffer doesn't
+                    raise TypeError(f"Ambiguous storage unit of bitfield {field.name}")
+
+                if unit_type is None or remaining < 1 or unit_type.size != field_type.size:
+                    unit_type = field_type
+                    unit_item = '{}[{}]'.format(data, _index(index, count))
+                    remaining = field_type.size * 8
+                    fmt.append(field_type.packchar)
+                    count += 1
+
+                if field.bits > remaining:
+                    raise TypeError(f"Bitfield {field.name} overflows its storage unit")
+
+                if self.cstruct.endian != '>':
+                    shift = unit_type.size * 8 - remaining
                 else:
-                    pack_char = read_type.packchar
+                    shift = remaining - field.bits
 
-                if cur_type != pack_char:
-                    fmt.append('{}{}'.format(cur_count, cur_type))
-                    cur_count = 0
+                getter = '({} >> {:d})'.format(unit_item, shift) if shift else unit_item
+                entries.append((field.name, '{} & {:#x}'.format(getter, (1 << field.bits) - 1), None))
+                remaining -= field.bits
+                continue
 
-                cur_count += char_count
-                cur_type = pack_char
+            unit_type = None
 
-            if isinstance(read_type, BytesInteger):
-                getter = 'BytesInteger.parse(buf[{slice}], {size}, {count}, {signed}, self.cstruct.endian){data_slice}'
+            if isinstance(field_type, Union) and field_type.anonymous:
+                raise TypeError("Anonymous unions can't be decoded statically")
 
-                getter = getter.format(
-                    slice=read_slice,
-                    size=read_type.size,
-                    count=count,
-                    signed=read_type.signed,
-                    data_slice='[0]' if count == 1 else '',
+            if isinstance(field_type, Structure) and field_type.anonymous:
+                # Anonymous structures are merged into the parent
+                field_fmt, field_count, field_entries = self._gen_entries(
+                    field_type.fields, _index(index, count), data, ctx
                 )
-            elif isinstance(read_type, (CharType, WcharType)):
-                getter = 'buf[{}]'.format(read_slice)
-
-                if isinstance(read_type, WcharType):
-                    getter += ".decode('utf-16-le' if self.cstruct.endian == '<' else 'utf-16-be')"
+                entries.extend(field_entries)
             else:
-                getter = 'data[{}]'.format(read_slice)
+                field_fmt, field_count, getter = self._gen_value(field_type, _index(index, count), data, ctx)
+                entries.append((field.name, getter, len(field_type)))
 
-            if isinstance(field_type, (Enum, Flag)):
-                getter = '{enum_type}Instance(self.cstruct.{type_name}, {getter})'.format(
-                    enum_type=field_type.__class__.__name__,
-                    type_name=field_type.name,
-                    getter=getter
-                )
-            elif isinstance(field_type, Array) and isinstance(field_type.type, (Enum, Flag)):
-                getter = '[{enum_type}Instance(self.cstruct.{type_name}, d) for d in {getter}]'.format(
-                    enum_type=field_type.type.__class__.__name__,
-                    type_name=field_type.type.name,
-                    getter=getter
-                )
-            elif isinstance(field_type, Pointer):
-                getter = 'PointerInstance(self.cstruct.{type_name}, stream, {getter}, r)'.format(
-                    type_name=field_type.type.name,
-                    getter=getter
-                )
-            elif isinstance(field_type, Array) and isinstance(field_type.type, Pointer):
-                getter = '[PointerInstance(self.cstruct.{type_name}, stream, d, r) for d in {getter}]'.format(
-                    type_name=field_type.type.name,
-                    getter=getter
-                )
-            elif isinstance(field_type, Array) and isinstance(read_type, PackedType):
-                getter = 'list({})'.format(getter)
+            fmt.append(field_fmt)
+            count += field_count
+
+        return ''.join(fmt), count, entries
+
+    def _gen_value(self, field_type, index, data, ctx):
+        """Generate the getter of a value of a statically sized type.
+
+        See _gen_entries() for the arguments.
+
+        Returns:
+            A tuple of the struct format, the number of items it unpacks to and the getter.
+
+        Raises:
+            TypeError: If the type can't be decoded statically.
+        """
+        if not isinstance(field_type, self.TYPES):
+            raise TypeError(f"Unsupported type for compiler: {field_type}")
+
+        item = '{}[{}]'.format(data, index)
+
+        if isinstance(field_type, Union):
+            # Members of a union overlap, so decode them from the raw bytes
+            return '{:d}s'.format(len(field_type)), 1, '{}.reads({})'.format(self._type_ref(field_type), item)
 
-            read_code.append(
-                'r["{name}"] = {getter}'.format(name=field.name, getter=getter)
+        if isinstance(field_type, Structure):
+            if self.cstruct.lazy and field_type._lazy_layout():
+                raise TypeError("Structures that are read lazily are read by their own type")
+
+            return self._gen_instance(field_type, self._type_ref(field_type), index, data)
+
+        if isinstance(field_type, (Enum, Flag)):
+            fmt, count, getter = self._gen_value(field_type.type, index, data, ctx)
+            if not self.cstruct.raw_enums:
+                getter = '{}._from_int({})'.format(self._type_ref(field_type), getter)
+            return fmt, count, getter
+
+        if isinstance(field_type, Pointer):
+            if ctx is None:
+                raise TypeError("Pointers can only be decoded in the context of the structure being read")
+
+            fmt, count, getter = self._gen_value(self.cstruct.pointer, index, data, ctx)
+            getter = 'PointerInstance({}, stream, {}, {}, {}.address_space)'.format(
+                self._type_ref(field_type.type), getter, ctx, self._type_ref(field_type)
             )
-            read_code.append(
-                'sizes["{name}"] = {size}'.format(name=field.name, size=count * read_type.size)
+            return fmt, count, getter
+
+        if isinstance(field_type, PackedType):
+            return field_type.packchar, 1, item
+
+        if isinstance(field_type, CharType):
+            return '1s', 1, item
+
+        if isinstance(field_type, WcharType):
+            return '2s', 1, '{}.decode({!r})'.format(item, self._wchar_encoding)
+
+        if isinstance(field_type, BytesInteger):
+            getter = 'int.from_bytes({}, {!r}, signed={})'.format(
+                item, 'little' if self.cstruct.endian == '<' else 'big', field_type.signed
+            )
+            return '{:d}s'.format(field_type.size), 1, getter
+
+        if not isinstance(field_type, Array) or field_type.dynamic or field_type.null_terminated:
+            raise TypeError(f"Type can't be decoded statically: {field_type}")
+
+        num = field_type.count
+        item_type = self.cstruct.resolve(field_type.type)
+
+        if isinstance(item_type, (Structure, Pointer)):
+            # Decode each element from its own range in the same tuple
+            var = '_i{:d}'.format(self._depth)
+            self._depth += 1
+            try:
+                fmt, count, getter = self._gen_value(item_type, _index(var, 0), data, ctx)
+            finally:
+                self._depth -= 1
+
+            getter = '[{} for {} in range({}, {}, {:d})]'.format(
+                getter, var, index, _index(index, count * num), count
+            ) if count else '[{} for _ in range({:d})]'.format(getter, num)
+            return fmt * num, count * num, getter
+
+        enum_type = None
+        if isinstance(item_type, (Enum, Flag)):
+            enum_type = item_type
+            item_type = item_type.type
+
+        if isinstance(item_type, PackedType) and not enum_type and self._is_typed_array(item_type):
+            fmt = '{:d}s'.format(num * item_type.size)
+            count = 1
+            getter = '{}.unpack_array({})'.format(self._type_ref(item_type), item)
+        elif isinstance(item_type, PackedType):
+            fmt = '{:d}{}'.format(num, item_type.packchar)
+            count = num
+            items = '{}[{}:{}]'.format(data, index, _index(index, num))
+            getter = 'list({})'.format(items)
+        elif isinstance(item_type, CharType):
+            return '{:d}s'.format(num), 1, item
+        elif isinstance(item_type, WcharType):
+            return '{:d}s'.format(num * 2), 1, '{}.decode({!r})'.format(item, self._wchar_encoding)
+        elif isinstance(item_type, BytesInteger) and not enum_type and self._is_typed_array(item_type):
+            fmt = '{:d}s'.format(num * item_type.size)
+            count = 1
+            getter = '{}.unpack_array({})'.format(self._type_ref(item_type), item)
+        elif isinstance(item_type, BytesInteger):
+            fmt = '{:d}s'.format(num * item_type.size)
+            count = 1
+            items = getter = 'BytesInteger.parse({}, {:d}, {:d}, {}, {!r})'.format(
+                item, item_type.size, num, item_type.signed, self.cstruct.endian
+            )
+        else:
+            raise TypeError(f"Unsupported type for compiler: {item_type}")
+
+        if enum_type and not self.cstruct.raw_enums:
+            getter = 'list(map({}._from_int, {}))'.format(self._type_ref(enum_type), items)
+
+        return fmt, count, getter
+
+    def _gen_instance(self, structure, type_ref, index, data):
+        """Generate the code that builds an Instance of a statically sized structure.
+
+        See _gen_value() for the arguments and return value, type_ref is the code
+        that refers to the structure.
+        """
+        if not isinstance(structure, Structure) or isinstance(structure, Union):
+            raise TypeError(f"Type is not a structure: {structure}")
+
+        offset = 0
+        for field in structure.fields:
+            if field.bits:
+                # Bitfields are laid out by _gen_entries(), the size check below covers them
+                offset = None
+                continue
+
+            if offset is not None and field.offset is not None and field.offset != offset:
+                raise TypeError(f"Unexpected offset of field {field.name}")
+
+            if offset is not None:
+                offset += len(field.type)
+
+        fmt, count, entries = self._gen_entries(structure.fields, index, data, None)
+        if struct.calcsize(self.cstruct.endian + fmt) != len(structure):
+            raise TypeError(f"Unexpected size of structure {structure.name}")
+
+        sizes = 'None'
+        if self.cstruct.track_sizes:
+            sizes = self._sizes_ref([(name, size) for name, _, size in entries if size is not None])
+        instance = self._instance_ref(structure)
+        if instance is None:
+            getter = '{}({}, OrderedDict([{}]), {})'.format(
+                self._generic_instance(structure),
+                type_ref,
+                ', '.join('("{}", {})'.format(name, getter) for name, getter, _ in entries),
+                sizes,
             )
+        else:
+            getter = '{}({}, {}, {})'.format(instance, type_ref, sizes, ', '.join(getter for _, getter, _ in entries))
+        return fmt, count, getter
 
-            data_offset += data_count
-            buf_offset += count * read_type.size
+    def gen_expression(self, expression, names):
+        """Generate the code that evaluates an expression over the fields that are read so far.
 
-        if cur_count:
-            fmt.append('{}{}'.format(cur_count, cur_type))
+        Raises:
+            TypeError: If the expression can't be compiled.
+        """
 
-        return template.format(''.join(fmt), '\n'.join(read_code))
+        def resolve(name):
+            if name in names:
+                return 'r["{}"]'.format(name)
 
-    def gen_dynamic_block(self, field):
+        try:
+            return expression.translate(resolve)
+        except ValueError:
+            raise TypeError(f"Couldn't compile expression {expression!r}")
+
+    def gen_dynamic_block(self, field, names):
         if not isinstance(field.type, Array):
             raise TypeError(f"Only Array can be dynamic, got {field.type!r}")
 
         field_type = self.cstruct.resolve(field.type.type)
+        enum_type = None
         reader = None
 
         if isinstance(field_type, (Enum, Flag)):
+            enum_type = field_type
             field_type = field_type.type
 
         if not field.type.count:  # Null terminated
-            if isinstance(field_type, PackedType):
+            if isinstance(field_type, PackedType) and field_type.packchar in 'efd':
+                # Negative zero also terminates, so these can't be scanned for null bytes
                 reader = (
                     't = []\n'
                     'while True:\n'
                     '    d = stream.read({size})\n'
                     '    if len(d) != {size}: raise EOFError()\n'
-                    '    v = struct.unpack(self.cstruct.endian + "{packchar}", d)[0]\n'
+                    '    v = {struct_ref}.unpack(d)[0]\n'
                     '    if v == 0: break\n'
-                    '    t.append(v)'.format(size=field_type.size, packchar=field_type.packchar)
+                    '    t.append(v)'.format(size=field_type.size, struct_ref=self._struct_ref(field_type.packchar))
                 )
-
-            elif isinstance(field_type, (CharType, WcharType)):
+            elif isinstance(field_type, PackedType) and not enum_type and self._is_typed_array(field_type):
                 reader = (
-                    't = []\n'
-                    'while True:\n'
-                    '    c = stream.read({size})\n'
-                    '    if len(c) != {size}: raise EOFError()\n'
-                    '    if c == b"{null}": break\n'
-                    '    t.append(c)\n'
-                    't = b"".join(t)'.format(size=field_type.size, null='\\x00' * field_type.size)
+                    'd = read_null_terminated(stream, {size})\n'
+                    't = {type_ref}.unpack_array(d)'.format(size=field_type.size, type_ref=self._type_ref(field_type))
                 )
+            elif isinstance(field_type, PackedType):
+                reader = (
+                    'd = read_null_terminated(stream, {size})\n'
+                    't = list(struct.unpack("{endian}%d{packchar}" % (len(d) // {size}), d))'.format(
+                        size=field_type.size,
+                        endian=self.cstruct.endian,
+                        packchar=field_type.packchar,
+                    )
+                )
+            elif isinstance(field_type, (CharType, WcharType)):
+                reader = 't = read_null_terminated(stream, {size})'.format(size=field_type.size)
 
                 if isinstance(field_type, WcharType):
-                    reader += ".decode('utf-16-le' if self.cstruct.endian == '<' else 'utf-16-be')"
+                    reader += '.decode({!r})'.format(self._wchar_encoding)
+            elif isinstance(field_type, BytesInteger) and not enum_type and self._is_typed_array(field_type):
+                reader = 't = {}.unpack_array(read_null_terminated(stream, {:d}, partial=True))'.format(
+                    self._type_ref(field_type), field_type.size
+                )
             elif isinstance(field_type, BytesInteger):
                 reader = (
-                    't = []\n'
-                    'while True:\n'
-                    '    d = stream.read({size})\n'
-                    '    if len(d) != {size}: raise EOFError()\n'
-                    '    v = BytesInteger.parse(d, {size}, 1, {signed}, self.cstruct.endian)\n'
-                    '    if v == 0: break\n'
-                    '    t.append(v)'.format(size=field_type.size, signed=field_type.signed)
+                    'd = read_null_terminated(stream, {size}, partial=True)\n'
+                    't = BytesInteger.parse(d, {size}, len(d) // {size}, {signed}, {endian!r})'.format(
+                        size=field_type.size,
+                        signed=field_type.signed,
+                        endian=self.cstruct.endian,
+                    )
                 )
 
-            if isinstance(field_type, (Enum, Flag)):
-                reader += '\nt = [{enum_type}Instance(self.cstruct.{type_name}, d) for d in t]'.format(
-                    enum_type=field_type.__class__.__name__,
-                    type_name=field_type.name
-                )
+            if reader and enum_type and not self.cstruct.raw_enums:
+                reader += '\nt = list(map({}._from_int, t))'.format(self._type_ref(enum_type))
 
             if not reader:
                 raise TypeError(f"Couldn't compile a reader for array {field!r}, {field_type!r}.")
 
-            return 's = stream.tell()\n{reader}\nr["{name}"]' \
-                   ' = t\nsizes["{name}"] = stream.tell() - s'.format(reader=reader, name=field.name)
+            return '{tell}{reader}\nr["{name}"] = t{size}'.format(
+                tell=self._gen_tell(),
+                reader=reader,
+                name=field.name,
+                size=self._gen_size(field.name, 'stream.tell() - s'),
+            )
 
-        expr = field.type.count.expression
+        expr = self.gen_expression(field.type.count, names)
         expr_read = (
-            'dynsize = max(0, Expression(self.cstruct, "{expr}").evaluate(r))\n'
+            'dynsize = max(0, {expr})\n'
             'buf = stream.read(dynsize * {type_size})\n'
             'if len(buf) != dynsize * {type_size}: raise EOFError()\n'
-            'r["{name}"] = {{reader}}\n'
-            'sizes["{name}"] = dynsize * {type_size}'.format(expr=expr, name=field.name, type_size=field_type.size)
+            'r["{name}"] = {{reader}}{size}'.format(
+                expr=expr,
+                name=field.name,
+                type_size=field_type.size,
+                size=self._gen_size(field.name, 'dynsize * {:d}'.format(field_type.size)),
+            )
         )
 
-        if isinstance(field_type, PackedType):
-            reader = 'list(struct.unpack(self.cstruct.endian + "{{:d}}{packchar}".format(dynsize), buf))'.format(
+        if isinstance(field_type, PackedType) and not enum_type and self._is_typed_array(field_type):
+            reader = '{}.unpack_array(buf)'.format(self._type_ref(field_type))
+        elif isinstance(field_type, PackedType):
+            reader = 'list(struct.unpack("{endian}%d{packchar}" % dynsize, buf))'.format(
+                endian=self.cstruct.endian,
                 packchar=field_type.packchar,
             )
         elif isinstance(field_type, (CharType, WcharType)):
             reader = 'buf'
             if isinstance(field_type, WcharType):
-                reader += ".decode('utf-16-le' if self.cstruct.endian == '<' else 'utf-16-be')"
+                reader += '.decode({!r})'.format(self._wchar_encoding)
+        elif isinstance(field_type, BytesInteger) and not enum_type and self._is_typed_array(field_type):
+            reader = '{}.unpack_array(buf)'.format(self._type_ref(field_type))
         elif isinstance(field_type, BytesInteger):
-            reader = 'BytesInteger.parse(buf, {size}, dynsize, {signed}, self.cstruct.endian)'.format(
+            reader = 'BytesInteger.parse(buf, {size}, dynsize, {signed}, {endian!r})'.format(
+                endian=self.cstruct.endian,
                 size=field_type.size,
                 signed=field_type.signed
             )
 
-        if isinstance(field_type, (Enum, Flag)):
-            reader += '[{enum_type}Instance(self.cstruct.{type_name}, d) for d in {reader}]'.format(
-                enum_type=field_type.__class__.__name__,
-                type_name=field_type.name,
-                reader=reader
-            )
+        if reader and enum_type and not self.cstruct.raw_enums:
+            reader = 'list(map({}._from_int, {}))'.format(self._type_ref(enum_type), reader)
+
+        if not reader:
+            raise TypeError(f"Couldn't compile a reader for array {field!r}, {field_type!r}.")
 
         return expr_read.format(reader=reader, size=None)
+
+
+def _indent(code, level):
+    """Indent every line of code by the given number of levels."""
+    return '\n'.join('    ' * level + line if line else line for line in code.split('\n'))
+
+
+def _attr(obj, name):
+    """Return the code to access the attribute name of obj."""
+    if name.isidentifier() and not keyword.iskeyword(name):
+        return '{}.{}'.format(obj, name)
+
+    return 'getattr({}, {!r})'.format(obj, name)
+
+
+def _is_slots(names):
+    """Return whether the given field names can be used as slots of a CompiledInstance."""
+    if len(set(names)) != len(names):
+        return False
+
+    for name in names:
+        if not name.isidentifier() or keyword.iskeyword(name) or name.startswith('__'):
+            return False
+
+        if name in ('self', '_type', '_sizes') or hasattr(CompiledInstance, name):
+            return False
+
+    return True
+
+
+def _field_names(cstruct, fields):
+    """Yield the names of the values that reading the given fields results in."""
+    for field in fields:
+        field_type = cstruct.resolve(field.type)
+        if isinstance(field_type, Structure) and field_type.anonymous:
+            yield from _field_names(cstruct, field_type.fields)
+        else:
+            yield field.name
+
+
+def _index(index, offset):
+    """Return index + offset, where index can be an int or code."""
+    if isinstance(index, int):
+        return index + offset
+
+    if not offset:
+        return index
+
+    return '{} + {:d}'.format(index, offset)
@@ -1,22 +1,27 @@
 # TODO:
 # - Rework definition parsing, maybe pycparser?
-# - Change expression implementation
-# - Lazy reading?
 from __future__ import print_function
 import ctypes as _ctypes
 import sys
+import weakref
 
 from io import BytesIO
+from dissect.cstruct.cache import DefinitionCache
+from dissect.cstruct.compiler import Compiler
+from dissect.cstruct.dtype import require_numpy
 from dissect.cstruct.exceptions import ResolveError
 from dissect.cstruct.types.base import Array
 from dissect.cstruct.types.bytesinteger import BytesInteger
 from dissect.cstruct.types.chartype import CharType
 from dissect.cstruct.types.packedtype import PackedType
-from dissect.cstruct.types.pointer import Pointer
+from dissect.cstruct.types.pointer import Pointer, PointerCache
 from dissect.cstruct.types.voidtype import VoidType
 from dissect.cstruct.types.wchartype import WcharType
 from dissect.cstruct.parser import CStyleParser, TokenParser
 
+# The supported values of the array_type option
+ARRAY_TYPES = ('list', 'array', 'memoryview', 'numpy')
+
 
 class cstruct(object):
     """Main class of cstruct. All types are registered in here.
@@ -24,12 +29,47 @@ class cstruct(object):
     Args:
         endian: The endianness to use when parsing.
         pointer: The pointer type to use for Pointers.
+        cache_dir: Optional directory to cache the results of loading definitions in.
+            Loading the same definitions again, e.g. in another process, then
+            skips parsing and compiling them. Cache entries are unpickled, so the
+            directory must be trusted, see DefinitionCache.
+        track_sizes: Whether to record the size of every field that is read. Reading
+            is faster without, the sizes are then determined when they are requested.
+        lazy: Whether to read structures with a static layout lazily. Fields of such
+            structures are only decoded when they are accessed.
+        keep_raw: Whether instances keep the bytes they were read from. Writing them
+            then reuses those bytes, with only the modified fields encoded again.
+        array_type: The type of arrays of integers and floats. Either 'list', 'array'
+            for array.array, 'memoryview' for a memoryview that is cast to the type,
+            which falls back to array.array if the endianness doesn't match the host,
+            or 'numpy' for numpy.ndarray. Only 'numpy' also applies to arrays of
+            integers of arbitrary sizes, like uint24.
+        raw_enums: Whether structures keep the raw integer values of enum and flag
+            fields, which are then only wrapped into enum instances when accessed.
+        pointer_cache: The maximum number of values read through pointers that are
+            cached per stream, 0 disables the cache. Pointers to the same address in
+            a stream then share the value that is read.
+        address_space: Optional AddressSpace to dereference pointers through, see
+            dissect.cstruct.addrspace. Pointers are otherwise dereferenced by reading
+            the stream they were read from at their address.
     """
 
     DEF_CSTYLE = 1
     DEF_LEGACY = 2
 
-    def __init__(self, endian='<', pointer=None, align=None):
+    def __init__(self, endian='<', pointer=None, align=None, cache_dir=None, track_sizes=True, lazy=False,
+                 keep_raw=False, array_type='list', raw_enums=False, pointer_cache=0,
+                 address_space=None):
+        self._compiled_types = weakref.WeakSet()
+        self._track_sizes = track_sizes
+        self._lazy = lazy
+        self._keep_raw = keep_raw
+        self._array_type = self._check_array_type(array_type)
+        self._raw_enums = raw_enums
+        self._pointer_caches = weakref.WeakKeyDictionary()
+        self.pointer_cache_size = pointer_cache
+        self.address_space = address_space
+        self.cache_dir = cache_dir
         self.endian = endian
 
         self.consts = {}
@@ -90,6 +130,106 @@ class cstruct(object):
         self.align = align
         self._anonymous_count = 0
 
+    @property
+    def endian(self):
+        return self._endian
+
+    @endian.setter
+    def endian(self, endian):
+        self._endian = endian
+
+        # Compiled structures are specialized for a specific endianness
+        self._recompile()
+
+    @property
+    def track_sizes(self):
+        return self._track_sizes
+
+    @track_sizes.setter
+    def track_sizes(self, track_sizes):
+        self._track_sizes = track_sizes
+
+        # Compiled structures only contain the code to track sizes when enabled
+        self._recompile()
+
+    @property
+    def lazy(self):
+        return self._lazy
+
+    @lazy.setter
+    def lazy(self, lazy):
+        self._lazy = lazy
+
+        # Compiled structures that can be read lazily have a different reader
+        self._recompile()
+
+    @property
+    def keep_raw(self):
+        return self._keep_raw
+
+    @keep_raw.setter
+    def keep_raw(self, keep_raw):
+        self._keep_raw = keep_raw
+
+        # Compiled structures only contain the code to keep the raw bytes when enabled
+        self._recompile()
+
+    @property
+    def array_type(self):
+        return self._array_type
+
+    @array_type.setter
+    def array_type(self, array_type):
+        self._array_type = self._check_array_type(array_type)
+
+        # Compiled structures decode arrays with the code for the array type
+        self._recompile()
+
+    @property
+    def raw_enums(self):
+        return self._raw_enums
+
+    @raw_enums.setter
+    def raw_enums(self, raw_enums):
+        self._raw_enums = raw_enums
+
+        # Compiled structures decode enums differently for raw values
+        self._recompile()
+
+    def cached_pointers(self, stream):
+        """Return the cache of the values read through pointers in the given stream or address space.
+
+        Returns None if the cache is disabled or the stream doesn't support weak references.
+        """
+        if not self.pointer_cache_size:
+            return None
+
+        try:
+            cache = self._pointer_caches.get(stream)
+        except TypeError:
+            return None
+
+        if cache is None:
+            cache = self._pointer_caches[stream] = PointerCache(self.pointer_cache_size)
+
+        return cache
+
+    @staticmethod
+    def _check_array_type(array_type):
+        if array_type not in ARRAY_TYPES:
+            raise ValueError("Invalid array type: %r" % array_type)
+
+        if array_type == 'numpy':
+            require_numpy()
+
+        return array_type
+
+    def _recompile(self):
+        if self._compiled_types:
+            compiler = Compiler(self)
+            for compiled in list(self._compiled_types):
+                compiler.recompile(compiled)
+
     def __getattr__(self, attr):
         try:
             return self.typedefs[attr]
@@ -143,11 +283,22 @@ class cstruct(object):
         """
         deftype = deftype or cstruct.DEF_CSTYLE
 
+        if self.cache_dir:
+            cache = DefinitionCache(self, self.cache_dir)
+            key = cache.key(definition, deftype, kwargs)
+            if cache.load(key):
+                return
+
+            snapshot = cache.snapshot()
+
         if deftype == cstruct.DEF_CSTYLE:
             TokenParser(self, **kwargs).parse(definition)
         elif deftype == cstruct.DEF_LEGACY:
             CStyleParser(self, **kwargs).parse(definition)
 
+        if self.cache_dir:
+            cache.store(key, snapshot)
+
     def loadfile(self, path, deftype=None, **kwargs):
         """Load structure definitions from a file.
 
@@ -0,0 +1,44 @@
+"""Support for NumPy arrays and dtypes.
+
+NumPy is an optional dependency, the functions in this module raise an
+ImportError if it isn't installed.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# NumPy byte order characters of the endianness characters of the struct module
+BYTEORDERS = {
+    '<': '<',
+    '>': '>',
+    '!': '>',
+    '@': '=',
+    '=': '=',
+}
+
+
+def require_numpy():
+    """Raise an ImportError if NumPy isn't installed."""
+    if numpy is None:
+        raise ImportError("NumPy is required for this functionality, but it isn't installed")
+
+
+def integer_dtype(size, signed, endian):
+    """Return the NumPy dtype of an integer of the given size in bytes and endianness."""
+    require_numpy()
+    return numpy.dtype('{}{}{:d}'.format(BYTEORDERS[endian], 'i' if signed else 'u', size))
+
+
+def packed_dtype(packchar, size, endian):
+    """Return the NumPy dtype of a struct format character of the given size in the given endianness."""
+    require_numpy()
+
+    if packchar in 'efd':
+        kind = 'f'
+    elif packchar.islower():
+        kind = 'i'
+    else:
+        kind = 'u'
+
+    return numpy.dtype('{}{}{:d}'.format(BYTEORDERS[endian], kind, size))
@@ -14,3 +14,7 @@ class ResolveError(Error):
 
 class NullPointerDereference(Error):
     pass
+
+
+class AddressError(Error):
+    pass
@@ -1,77 +1,196 @@
+import operator
+import re
+
+
 class Expression(object):
-    """Expression parser for simple calculations in definitions."""
+    """Expression parser for simple calculations in definitions.
+
+    Expressions support integer literals, names and the C operators below, with
+    the usual C precedence. Names are looked up in the evaluation context first
+    and in the constants of the cstruct instance second.
 
+    The expression is parsed once, on first use, into a tree of closures that is
+    cached on the object.
+    """
+
+    # Binary operators, ordered from lowest to highest precedence
     operators = [
-        ('*', lambda a, b: a * b),
-        ('/', lambda a, b: a // b),
-        ('%', lambda a, b: a % b),
-        ('+', lambda a, b: a + b),
-        ('-', lambda a, b: a - b),
-        ('>>', lambda a, b: a >> b),
-        ('<<', lambda a, b: a << b),
-        ('&', lambda a, b: a & b),
-        ('^', lambda a, b: a ^ b),
-        ('|', lambda a, b: a | b),
+        [('|', operator.or_)],
+        [('^', operator.xor)],
+        [('&', operator.and_)],
+        [('<<', operator.lshift), ('>>', operator.rshift)],
+        [('+', operator.add), ('-', operator.sub)],
+        [('*', operator.mul), ('/', operator.floordiv), ('%', operator.mod)],
     ]
 
+    unary_operators = {
+        '-': operator.neg,
+        '+': operator.pos,
+        '~': operator.invert,
+    }
+
+    python_operators = {
+        '/': '//',
+    }
+
+    tokenizer = re.compile(r'\s*(?:(0x[0-9a-fA-F]+|\d+)|([a-zA-Z_][a-zA-Z0-9_]*)|(<<|>>|[-+~*/%&^|()]))')
+
     def __init__(self, cstruct, expression):
         self.cstruct = cstruct
         self.expression = expression
+        self._tree = None
+        self._evaluator = None
 
     def __repr__(self):
         return self.expression
 
-    def evaluate(self, context={}):
-        level = 0
-        levels = []
-        buf = ''
+    def __getstate__(self):
+        # The evaluator is a tree of closures, which can't be pickled
+        state = self.__dict__.copy()
+        state['_evaluator'] = None
+        return state
+
+    def evaluate(self, context=None):
+        if self._evaluator is None:
+            self._evaluator = self._build(self.tree)
+
+        return self._evaluator({} if context is None else context)
+
+    def translate(self, resolve):
+        """Translate this expression into an equivalent Python expression.
+
+        Constants are folded into the resulting code.
+
+        Args:
+            resolve: Callable that returns the code to access a name from the
+                evaluation context, or None if the name isn't in the context.
+
+        Returns:
+            The Python source code of the expression.
+
+        Raises:
+            ValueError: If the expression contains an unknown name.
+        """
+        return self._translate(self.tree, resolve)
+
+    @property
+    def tree(self):
+        """The parsed expression, as nested tuples."""
+        if self._tree is None:
+            self._tree = self._parse()
+
+        return self._tree
+
+    def _tokenize(self):
+        tokens = []
+        pos = 0
+        expression = self.expression.rstrip()
+
+        while pos < len(expression):
+            match = self.tokenizer.match(expression, pos)
+            if not match:
+                raise ValueError(f"Invalid expression {self.expression!r}")
+
+            number, name, op = match.groups()
+            if number is not None:
+                tokens.append(('num', int(number, 16) if number.startswith('0x') else int(number)))
+            elif name is not None:
+                tokens.append(('name', name))
+            else:
+                tokens.append(('op', op))
+
+            pos = match.end()
+
+        return tokens
+
+    def _parse(self):
+        tokens = self._tokenize()
+        tree, pos = self._parse_binary(tokens, 0, 0)
+
+        if pos != len(tokens):
+            raise ValueError(f"Invalid expression {self.expression!r}")
+
+        return tree
+
+    def _parse_binary(self, tokens, pos, level):
+        if level == len(self.operators):
+            return self._parse_unary(tokens, pos)
+
+        operators = dict(self.operators[level])
+        left, pos = self._parse_binary(tokens, pos, level + 1)
+
+        while pos < len(tokens) and tokens[pos][0] == 'op' and tokens[pos][1] in operators:
+            op = tokens[pos][1]
+            right, pos = self._parse_binary(tokens, pos + 1, level + 1)
+            left = ('binop', op, left, right)
+
+        return left, pos
+
+    def _parse_unary(self, tokens, pos):
+        if pos == len(tokens):
+            raise ValueError(f"Unexpected end of expression {self.expression!r}")
+
+        kind, value = tokens[pos]
+
+        if kind == 'op' and value in self.unary_operators:
+            operand, pos = self._parse_unary(tokens, pos + 1)
+            return ('unary', value, operand), pos
+
+        if kind == 'op' and value == '(':
+            tree, pos = self._parse_binary(tokens, pos + 1, 0)
+            if pos == len(tokens) or tokens[pos] != ('op', ')'):
+                raise ValueError(f"Unbalanced parentheses in expression {self.expression!r}")
+            return tree, pos + 1
+
+        if kind == 'op':
+            raise ValueError(f"Unexpected {value!r} in expression {self.expression!r}")
+
+        return tokens[pos], pos + 1
 
-        for i in range(len(self.expression)):
-            if self.expression[i] == '(':
-                level += 1
-                levels.append(buf)
-                buf = ''
-                continue
+    def _build(self, node):
+        """Build a closure that evaluates the given node against a context."""
+        kind = node[0]
 
-            if self.expression[i] == ')':
-                level -= 1
-                value = self.evaluate_part(buf, context)
-                buf = levels.pop()
-                buf += str(value)
-                continue
+        if kind == 'num':
+            value = node[1]
+            return lambda context: value
 
-            buf += self.expression[i]
+        if kind == 'name':
+            name = node[1]
+            consts = self.cstruct.consts
+            return lambda context: context[name] if name in context else consts[name]
 
-        return self.evaluate_part(buf, context)
+        if kind == 'unary':
+            func = self.unary_operators[node[1]]
+            operand = self._build(node[2])
+            return lambda context: func(operand(context))
 
-    def evaluate_part(self, buf, context):
-        buf = buf.strip()
+        func = dict(sum(self.operators, []))[node[1]]
+        left = self._build(node[2])
+        right = self._build(node[3])
+        return lambda context: func(left(context), right(context))
 
-        # Very simple way to support an expression(part) that is a single,
-        # negative value. To use negative values in more complex expressions,
-        # they must be wrapped in brackets, e.g.: 2 * (-5).
-        #
-        # To have full support for the negation operator a proper expression
-        # parser must be build.
-        if buf.startswith('-') and buf[1:].isnumeric():
-            return int(buf)
+    def _translate(self, node, resolve):
+        kind = node[0]
 
-        for operator in self.operators:
-            if operator[0] in buf:
-                a, b = buf.rsplit(operator[0], 1)
+        if kind == 'num':
+            return repr(node[1])
 
-                return operator[1](
-                    self.evaluate_part(a, context),
-                    self.evaluate_part(b, context)
-                )
+        if kind == 'name':
+            code = resolve(node[1])
+            if code is not None:
+                return code
 
-        if buf in context:
-            return context[buf]
+            if node[1] in self.cstruct.consts:
+                return repr(self.cstruct.consts[node[1]])
 
-        if buf.startswith('0x'):
-            return int(buf, 16)
+            raise ValueError(f"Unknown name {node[1]!r} in expression {self.expression!r}")
 
-        if buf in self.cstruct.consts:
-            return self.cstruct.consts[buf]
+        if kind == 'unary':
+            return '({}{})'.format(node[1], self._translate(node[2], resolve))
 
-        return int(buf)
+        return '({} {} {})'.format(
+            self._translate(node[2], resolve),
+            self.python_operators.get(node[1], node[1]),
+            self._translate(node[3], resolve),
+        )
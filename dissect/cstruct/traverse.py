@@ -0,0 +1,162 @@
+"""Traversal of structures that are linked through pointers, like lists and trees."""
+import bisect
+from collections import deque
+
+from dissect.cstruct.addrspace import AddressSpace, FileAddressSpace
+from dissect.cstruct.exceptions import AddressError
+from dissect.cstruct.types.pointer import PointerInstance
+
+
+class _PrefetchAddressSpace(AddressSpace):
+    """Address space that serves reads from ranges of another address space that were read ahead.
+
+    Reads outside of the prefetched ranges are passed on to the other address space.
+    """
+
+    def __init__(self, space):
+        self.space = space
+        self._starts = []
+        self._data = []
+
+    def prefetch(self, addrs, size, gap):
+        """Read the ranges of size bytes at the given sorted addresses, replacing the previous ones.
+
+        Ranges that are at most gap bytes apart are read with a single read. Ranges
+        that can't be read, like those that start at an unmapped address, are left
+        to be read when they're needed, and may end at an unmapped address.
+        """
+        runs = []
+        for addr in addrs:
+            if runs and addr - runs[-1][1] <= gap:
+                runs[-1][1] = max(runs[-1][1], addr + size)
+            else:
+                runs.append([addr, addr + size])
+
+        self._starts = []
+        self._data = []
+        for start, end in runs:
+            try:
+                data = self.space.read(start, end - start)
+            except AddressError:
+                continue
+
+            self._starts.append(start)
+            self._data.append(data)
+
+    def read(self, addr, size):
+        index = bisect.bisect_right(self._starts, addr) - 1
+        if index >= 0:
+            offset = addr - self._starts[index]
+            data = self._data[index]
+            if offset + size <= len(data):
+                return data[offset:offset + size]
+
+        return self.space.read(addr, size)
+
+
+def _value(node, field):
+    """Return the value of a field, nested fields are separated by dots."""
+    for name in field.split('.'):
+        node = node[name]
+
+    return node
+
+
+def _links(node, fields):
+    """Return the addresses a node links to through the given fields."""
+    for field in fields:
+        value = _value(node, field)
+        if isinstance(value, PointerInstance):
+            yield value._addr
+        elif isinstance(value, int):
+            yield value
+        else:
+            raise TypeError("Field %s is not a pointer or an address: %r" % (field, value))
+
+
+def _source(node, fields):
+    """Return the address space or stream the first pointer of a node is dereferenced through."""
+    for field in fields:
+        value = _value(node, field)
+        if isinstance(value, PointerInstance):
+            space = value._space()
+            return value._stream if space is None else space
+
+    raise ValueError("No source to read from, pass the stream or address space to read")
+
+
+def traverse(start, fields, source=None, type_=None, offset=0, addr=None, batch_size=64, gap=0x1000):
+    """Iterate over the structures that are linked to a start instance through pointers.
+
+    The pointers in the given fields are followed breadth-first. Every address is
+    visited once, so cycles, like the ones in circular lists, end the traversal.
+    The structures are read in batches: the known addresses of a batch are read in
+    sorted order, with nearby structures of a static size read at once, before
+    the structures are parsed in the order in which they were reached.
+
+    Args:
+        start: The instance to start at, it isn't yielded itself.
+        fields: The name of the field with the address of the next structure, or a
+            list of names to follow several, like the children in a tree. Fields
+            are pointers or integer addresses, fields of nested structures are
+            named like 'entry.Flink'. Null addresses aren't followed.
+        source: The file-like object or AddressSpace to read the structures from.
+            Defaults to where the first pointer field of start is dereferenced.
+        type_: The type of the linked structures, defaults to the type of start.
+        offset: The offset of the field that is linked to within the structures,
+            which is subtracted from the addresses. For lists in which the links
+            point to a list entry within the structures, like LIST_ENTRY.
+        addr: The address of start, to end the traversal when it's linked to again.
+        batch_size: The maximum number of structures that are read in one batch.
+        gap: The maximum distance in bytes between structures that are read at once.
+
+    Yields:
+        The instances of the linked structures.
+    """
+    if isinstance(fields, str):
+        fields = [fields]
+
+    type_ = type_ or start._type
+    if source is None:
+        source = _source(start, fields)
+
+    position = None
+    if not isinstance(source, AddressSpace):
+        position = source.tell()
+        source = FileAddressSpace(source)
+
+    space = _PrefetchAddressSpace(source)
+    stream = space.open()
+
+    try:
+        size = len(type_)
+    except TypeError:
+        size = None
+
+    visited = set()
+    if addr is not None:
+        visited.add(addr)
+
+    pending = deque(_links(start, fields))
+    try:
+        while pending:
+            batch = []
+            while pending and len(batch) < batch_size:
+                link = pending.popleft()
+                if not link or link - offset in visited:
+                    continue
+
+                visited.add(link - offset)
+                batch.append(link - offset)
+
+            if size is not None:
+                space.prefetch(sorted(batch), size, gap)
+
+            for node_addr in batch:
+                stream.seek(node_addr)
+                node = type_._read(stream)
+                pending.extend(_links(node, fields))
+                yield node
+    finally:
+        if position is not None:
+            source.fh.seek(position)
@@ -1,6 +1,122 @@
+import io
 from io import BytesIO
 from dissect.cstruct.expression import Expression
 
+NULL_SCAN_CHUNK_SIZE = 256
+NULL_SCAN_MAX_CHUNK_SIZE = 64 * 1024
+
+
+def _seekable(stream):
+    """Return whether the stream can be repositioned after reading ahead."""
+    seekable = getattr(stream, 'seekable', None)
+    if seekable is None or not seekable():
+        return False
+
+    try:
+        stream.seek(0, io.SEEK_CUR)
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+def read_null_terminated(stream, size, partial=False):
+    """Read elements of the given size up to and including a null element.
+
+    The stream is read in growing chunks that are searched for an aligned element
+    of null bytes. Afterwards the stream is positioned right after that terminator.
+    Streams that can't seek, like pipes and sockets, are read an element at a time
+    instead, so nothing is read past the terminator.
+
+    Args:
+        stream: The stream to read from.
+        size: The size of a single element.
+        partial: Whether a truncated element of null bytes at the end of the stream
+            also counts as terminator.
+
+    Returns:
+        The bytes of all elements before the terminator.
+
+    Raises:
+        EOFError: If the stream ends before a terminator is found.
+    """
+    null = b'\x00' * size
+    data = bytearray()
+
+    if not _seekable(stream):
+        while True:
+            element = stream.read(size)
+            if element == null:
+                return bytes(data)
+
+            if len(element) != size:
+                if partial and element and not any(element):
+                    return bytes(data)
+                raise EOFError()
+
+            data += element
+
+    chunk_size = NULL_SCAN_CHUNK_SIZE
+
+    while True:
+        # Only complete elements have been searched so far, continue with the first incomplete one
+        start = len(data) - len(data) % size
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            if partial and start != len(data) and not any(data[start:]):
+                return bytes(data[:start])
+            raise EOFError()
+
+        data += chunk
+
+        pos = data.find(null, start)
+        while pos != -1 and pos % size:
+            pos = data.find(null, pos + 1)
+
+        if pos != -1:
+            stream.seek(pos + size - len(data), io.SEEK_CUR)
+            return bytes(data[:pos])
+
+        chunk_size = min(chunk_size * 2, NULL_SCAN_MAX_CHUNK_SIZE)
+
+
+class BufferStream(object):
+    """Minimal read-only file-like object over a buffer, without copying it.
+
+    Args:
+        buffer: Any object that supports the buffer protocol, e.g. bytes, bytearray,
+            memoryview or mmap.
+        offset: The initial position in the buffer.
+    """
+
+    def __init__(self, buffer, offset=0):
+        self.view = memoryview(buffer).cast('B')
+        self.offset = offset
+
+    def read(self, size=-1):
+        start = self.offset
+        end = len(self.view) if size is None or size < 0 else min(start + size, len(self.view))
+        self.offset = max(start, end)
+        return self.view[start:end].tobytes()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.offset
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+
+        self.offset = offset
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def seekable(self):
+        return True
+
 
 class BaseType(object):
     """Base class for cstruct type classes."""
@@ -32,7 +148,22 @@ class BaseType(object):
             The parsed value of this type.
         """
 
-        return self._read(BytesIO(data))
+        return self.read_from(data)[0]
+
+    def read_from(self, buffer, offset=0):
+        """Parse a value of this type directly from a buffer, without copying it.
+
+        Args:
+            buffer: Any object that supports the buffer protocol, e.g. bytes,
+                bytearray, memoryview or mmap.
+            offset: The offset in the buffer to parse from.
+
+        Returns:
+            A tuple of the parsed value and the offset right after it.
+        """
+        stream = BufferStream(buffer, offset)
+        value = self._read(stream)
+        return value, stream.tell()
 
     def dumps(self, data):
         """Dump the given data according to the type that implements this class.
@@ -56,7 +187,7 @@ class BaseType(object):
         Returns:
             The parsed value of this type.
         """
-        if isinstance(obj, (str, bytes, memoryview)):
+        if isinstance(obj, (str, bytes, bytearray, memoryview)):
             return self.reads(obj)
 
         return self._read(obj)
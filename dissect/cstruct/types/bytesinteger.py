@@ -1,4 +1,17 @@
-from dissect.cstruct.types.base import RawType
+import struct
+
+from dissect.cstruct.dtype import integer_dtype, numpy
+from dissect.cstruct.types.base import RawType, read_null_terminated
+
+# Arrays with at least this many elements are converted all at once, by widening the
+# elements to the next native integer size and converting them with a single struct call
+BULK_THRESHOLD = 16
+
+# Native integer sizes with their signed and unsigned struct format characters
+BULK_WIDTHS = [(1, 'b', 'B'), (2, 'h', 'H'), (4, 'i', 'I'), (8, 'q', 'Q')]
+
+# Translation table from the most significant byte of a value to its sign extension byte
+SIGN_EXTEND = bytes(0xff if b & 0x80 else 0x00 for b in range(256))
 
 
 class BytesInteger(RawType):
@@ -10,69 +23,127 @@ class BytesInteger(RawType):
 
     @staticmethod
     def parse(buf, size, count, signed, endian):
-        nums = []
+        byteorder = 'little' if endian == '<' else 'big'
 
-        for c in range(count):
-            num = 0
-            data = buf[c * size:(c + 1) * size]
-            if endian == '<':  # little-endian (LE)
-                data = b''.join(data[i:i + 1] for i in reversed(range(len(data))))
+        if count >= BULK_THRESHOLD and size <= 8 and len(buf) >= count * size:
+            return BytesInteger._parse_bulk(buf, size, count, signed, byteorder)
 
-            ints = list(data)
-            for i in ints:
-                num = (num << 8) | i
+        return [int.from_bytes(buf[i:i + size], byteorder, signed=signed) for i in range(0, count * size, size)]
 
-            if signed and (num & (1 << (size * 8 - 1))):
-                bias = 1 << (size * 8 - 1)
-                num -= bias * 2
+    @staticmethod
+    def pack(data, size, endian):
+        byteorder = 'little' if endian == '<' else 'big'
 
-            nums.append(num)
+        if numpy is not None and isinstance(data, numpy.ndarray) and size <= 8:
+            return BytesInteger._pack_numpy(data, size, byteorder)
 
-        return nums
+        if len(data) >= BULK_THRESHOLD and size <= 8:
+            return BytesInteger._pack_bulk(data, size, byteorder)
+
+        mask = (1 << (size * 8)) - 1
+        # Negative and too large values are truncated to the size of the type
+        return b''.join((int(i) & mask).to_bytes(size, byteorder) for i in data)
 
     @staticmethod
-    def pack(data, size, endian):
-        buf = []
-        for i in data:
-            num = int(i)
-            if num < 0:
-                num += 1 << (size * 8)
+    def _bulk_layout(size, count, signed, byteorder):
+        """Return the width, struct format and offset of the value bytes in the widened elements."""
+        width, signed_char, unsigned_char = next(entry for entry in BULK_WIDTHS if entry[0] >= size)
+        fmt = '{}{:d}{}'.format('<' if byteorder == 'little' else '>', count, signed_char if signed else unsigned_char)
+        offset = 0 if byteorder == 'little' else width - size
+        return width, fmt, offset
 
-            d = [b'\x00'] * size
-            i = size - 1
+    @staticmethod
+    def _parse_bulk(buf, size, count, signed, byteorder):
+        width, fmt, offset = BytesInteger._bulk_layout(size, count, signed, byteorder)
+        buf = bytes(buf[:count * size])
+
+        if width == size:
+            return list(struct.unpack(fmt, buf))
+
+        wide = bytearray(count * width)
+        for i in range(size):
+            wide[offset + i::width] = buf[i::size]
+
+        if signed:
+            msb = size - 1 if byteorder == 'little' else 0
+            extension = buf[msb::size].translate(SIGN_EXTEND)
+            for i in list(range(offset)) + list(range(offset + size, width)):
+                wide[i::width] = extension
 
-            while i >= 0:
-                b = num & 255
-                d[i] = bytes((b,))
-                num >>= 8
-                i -= 1
+        return list(struct.unpack(fmt, wide))
 
-            if endian == '<':
-                d = b''.join(d[i:i + 1][0] for i in reversed(range(len(d))))
-            else:
-                d = b''.join(d)
+    @staticmethod
+    def _pack_bulk(data, size, byteorder):
+        width, fmt, offset = BytesInteger._bulk_layout(size, len(data), False, byteorder)
+        mask = (1 << (size * 8)) - 1
+        wide = struct.pack(fmt, *map(mask.__and__, map(int, data)))
+
+        if width == size:
+            return wide
 
-            buf.append(d)
+        buf = bytearray(len(data) * size)
+        for i in range(size):
+            buf[i::size] = wide[offset + i::width]
 
-        return b''.join(buf)
+        return bytes(buf)
+
+    @staticmethod
+    def _parse_numpy(buf, size, count, signed, byteorder):
+        width, _, offset = BytesInteger._bulk_layout(size, count, signed, byteorder)
+        dtype = integer_dtype(width, signed, '<' if byteorder == 'little' else '>')
+
+        if width == size:
+            return numpy.frombuffer(buf, dtype, count)
+
+        raw = numpy.frombuffer(buf, numpy.uint8, count * size).reshape(count, size)
+        wide = numpy.zeros((count, width), numpy.uint8)
+        wide[:, offset:offset + size] = raw
+
+        if signed:
+            msb = raw[:, size - 1 if byteorder == 'little' else 0]
+            extension = numpy.where(msb & 0x80, 0xff, 0x00).astype(numpy.uint8)[:, None]
+            wide[:, :offset] = extension
+            wide[:, offset + size:] = extension
+
+        return wide.view(dtype).reshape(count)
+
+    @staticmethod
+    def _pack_numpy(data, size, byteorder):
+        width, _, offset = BytesInteger._bulk_layout(size, len(data), False, byteorder)
+        # Casting to an unsigned integer truncates the values, like the mask in pack()
+        wide = data.astype(integer_dtype(width, False, '<' if byteorder == 'little' else '>'))
+        return wide.view(numpy.uint8).reshape(len(data), width)[:, offset:offset + size].tobytes()
+
+    def unpack_array(self, data, count=None):
+        """Unpack the bytes of an array of this type.
+
+        The values are returned as a numpy.ndarray if that's the array type that is
+        configured on the cstruct instance, or as a list otherwise.
+
+        Args:
+            data: The bytes of the array.
+            count: The number of values, all values in data by default.
+        """
+        if count is None:
+            count = len(data) // self.size
+
+        if self.cstruct.array_type == 'numpy' and self.size <= 8:
+            if len(data) < count * self.size:
+                raise EOFError("Read %d bytes, but expected %d" % (len(data), count * self.size))
+
+            byteorder = 'little' if self.cstruct.endian == '<' else 'big'
+            return self._parse_numpy(data, self.size, count, self.signed, byteorder)
+
+        return self.parse(data, self.size, count, self.signed, self.cstruct.endian)
 
     def _read(self, stream):
         return self.parse(stream.read(self.size * 1), self.size, 1, self.signed, self.cstruct.endian)[0]
 
     def _read_array(self, stream, count):
-        return self.parse(stream.read(self.size * count), self.size, count, self.signed, self.cstruct.endian)
+        return self.unpack_array(stream.read(self.size * count), count)
 
     def _read_0(self, stream):
-        result = []
-
-        while True:
-            v = self._read(stream)
-            if v == 0:
-                break
-
-            result.append(v)
-
-        return result
+        return self.unpack_array(read_null_terminated(stream, self.size, partial=True))
 
     def _write(self, stream, data):
         return stream.write(self.pack([data], self.size, self.cstruct.endian))
@@ -81,7 +152,7 @@ class BytesInteger(RawType):
         return stream.write(self.pack(data, self.size, self.cstruct.endian))
 
     def _write_0(self, stream, data):
-        return self._write_array(stream, data + [0])
+        return self._write_array(stream, list(data) + [0])
 
     def default(self):
         return 0
@@ -1,4 +1,4 @@
-from dissect.cstruct.types.base import RawType
+from dissect.cstruct.types.base import RawType, read_null_terminated
 
 
 class CharType(RawType):
@@ -17,27 +17,20 @@ class CharType(RawType):
         return stream.read(count)
 
     def _read_0(self, stream):
-        byte_array = []
-        while True:
-            bytes_stream = stream.read(1)
-            if bytes_stream == b'':
-                raise EOFError()
+        return read_null_terminated(stream, 1)
 
-            if bytes_stream == b'\x00':
-                break
-
-            byte_array.append(bytes_stream)
-
-        return b''.join(byte_array)
-
-    def _write(self, stream, data):
+    @staticmethod
+    def pack(data):
         if isinstance(data, int):
             data = chr(data)
 
         if isinstance(data, str):
             data = data.encode('latin-1')
 
-        return stream.write(data)
+        return data
+
+    def _write(self, stream, data):
+        return stream.write(self.pack(data))
 
     def _write_array(self, stream, data):
         return self._write(stream, data)
@@ -1,5 +1,9 @@
 from dissect.cstruct.types.base import RawType
 
+# Enums with only non-negative values below this factor times their number of values are
+# decoded through a table with an instance for every value in that range
+DENSE_FACTOR = 4
+
 
 class Enum(RawType):
     """Implements an Enum type.
@@ -19,6 +23,9 @@ class Enum(RawType):
             enum Test : uint16 {
                 A, B=5, C
             };
+
+    The instances of the values of the enum are shared, every value that is
+    read results in the same instance.
     """
 
     def __init__(self, cstruct, name, type_, values):
@@ -31,15 +38,40 @@ class Enum(RawType):
 
         super().__init__(cstruct, name, len(self.type))
 
+        self._instances = {value: self._new_instance(value) for value in self.reverse}
+        self._table = ()
+        if self.reverse and min(self.reverse) >= 0 and max(self.reverse) < DENSE_FACTOR * len(self.reverse):
+            self._table = tuple(
+                self._instances.get(value) or self._new_instance(value) for value in range(max(self.reverse) + 1)
+            )
+
     def __call__(self, value):
         if isinstance(value, int):
-            return EnumInstance(self, value)
+            return self._from_int(value)
         return super(Enum, self).__call__(value)
 
+    def _from_int(self, value):
+        """Return the instance of an integer value."""
+        if 0 <= value < len(self._table):
+            return self._table[value]
+
+        instance = self._instances.get(value)
+        if instance is None:
+            instance = self._new_instance(value)
+
+        return instance
+
+    def _new_instance(self, value):
+        return EnumInstance(self, value)
+
     def __getitem__(self, attr):
         return self(self.values[attr])
 
     def __getattr__(self, attr):
+        if attr == 'values':
+            # Not set yet, e.g. while unpickling
+            raise AttributeError(attr)
+
         try:
             return self(self.values[attr])
         except KeyError:
@@ -49,14 +81,13 @@ class Enum(RawType):
         return attr in self.values
 
     def _read(self, stream):
-        v = self.type._read(stream, )
-        return self(v)
+        return self._from_int(self.type._read(stream))
 
     def _read_array(self, stream, count):
-        return list(map(self, self.type._read_array(stream, count)))
+        return list(map(self._from_int, self.type._read_array(stream, count)))
 
     def _read_0(self, stream):
-        return list(map(self, self.type._read_0(stream)))
+        return list(map(self._from_int, self.type._read_0(stream)))
 
     def _write(self, stream, data):
         data = data.value if isinstance(data, EnumInstance) else data
@@ -78,11 +109,21 @@ class Enum(RawType):
 
 
 class EnumInstance(object):
-    """Implements a value instance of an Enum"""
+    """Implements a value instance of an Enum
+
+    Instances are immutable, because the instances of the values of an enum are shared.
+    """
+    __slots__ = ('enum', 'value')
 
     def __init__(self, enum, value):
-        self.enum = enum
-        self.value = value
+        object.__setattr__(self, 'enum', enum)
+        object.__setattr__(self, 'value', value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Enum instances are immutable")
+
+    def __reduce__(self):
+        return self.__class__, (self.enum, self.value)
 
     def __eq__(self, value):
         if isinstance(value, EnumInstance) and value.enum is not self.enum:
@@ -107,7 +148,8 @@ class EnumInstance(object):
 
     @property
     def name(self):
-        if self.value not in self.enum.reverse:
+        name = self.enum.reverse.get(self.value)
+        if name is None:
             return '{}_{}'.format(self.enum.name, self.value)
 
-        return self.enum.reverse[self.value]
+        return name
@@ -1,5 +1,8 @@
 from dissect.cstruct.types.enum import Enum, EnumInstance
 
+# Maximum number of decomposed values that are kept per flag
+DECOMPOSE_CACHE_SIZE = 1024
+
 
 class Flag(Enum):
     """Implements a Flag type.
@@ -19,17 +22,78 @@ class Flag(Enum):
             flag Test : uint16 {
                 A, B=4, C
             };
+
+    Decompositions of combined values are looked up through a table of the
+    members by their lowest bit, and the results are cached per value.
     """
 
-    def __call__(self, value):
-        if isinstance(value, int):
-            return FlagInstance(self, value)
+    def __init__(self, cstruct, name, type_, values):
+        super().__init__(cstruct, name, type_, values)
+
+        # Members in the order in which they are listed in decompositions
+        self._members = sorted(((k, v) for k, v in values.items() if v), key=lambda m: m[0], reverse=True)
+        # Indices of the positive members by their lowest set bit, negative members are always checked
+        self._bits = {}
+        self._unindexed = []
+        for index, (_, value) in enumerate(self._members):
+            if value < 0:
+                self._unindexed.append(index)
+            else:
+                self._bits.setdefault((value & -value).bit_length() - 1, []).append(index)
+
+        self._decompositions = {}
+
+    def _new_instance(self, value):
+        return FlagInstance(self, value)
+
+    def _decompose(self, value):
+        """Return the members a value consists of and the bits that aren't covered by them.
+
+        See FlagInstance.decompose(), the members are returned as a tuple.
+        """
+        try:
+            return self._decompositions[value]
+        except KeyError:
+            pass
+
+        if value < 0:
+            # Every member can be covered by the infinite set bits of a negative value
+            candidates = range(len(self._members))
+        else:
+            candidates = list(self._unindexed)
+            bits = value
+            while bits:
+                low = bits & -bits
+                candidates.extend(self._bits.get(low.bit_length() - 1, ()))
+                bits ^= low
+            candidates.sort()
+
+        members = []
+        not_covered = value
+        for index in candidates:
+            member = self._members[index]
+            if (member[1] & value) == member[1]:
+                members.append(member)
+                not_covered &= ~member[1]
+
+        if not members:
+            members.append((None, value))
+
+        if len(members) > 1 and members[0][1] == value:
+            members.pop(0)
+
+        result = (tuple(members), not_covered)
+        if len(self._decompositions) >= DECOMPOSE_CACHE_SIZE:
+            # Evict the oldest value
+            del self._decompositions[next(iter(self._decompositions))]
+        self._decompositions[value] = result
 
-        return super(Enum, self).__call__(value)
+        return result
 
 
 class FlagInstance(EnumInstance):
     """Implements a value instance of a Flag"""
+    __slots__ = ()
 
     def __bool__(self):
         return bool(self.value)
@@ -87,19 +151,5 @@ class FlagInstance(EnumInstance):
         return self.enum.reverse.get(self.value, None)
 
     def decompose(self):
-        members = []
-        not_covered = self.value
-
-        for name, value in self.enum.values.items():
-            if value and ((value & self.value) == value):
-                members.append((name, value))
-                not_covered &= ~value
-
-        if not members:
-            members.append((None, self.value))
-
-        members.sort(key=lambda m: m[0], reverse=True)
-        if len(members) > 1 and members[0][1] == self.value:
-            members.pop(0)
-
-        return members, not_covered
+        members, not_covered = self.enum._decompose(self.value)
+        return list(members), not_covered
@@ -1,15 +1,40 @@
-from io import BytesIO
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+def _is_modified(value):
+    """Return whether a value is, or contains, an instance that was modified after reading."""
+    if isinstance(value, Instance):
+        return bool(value._modified_fields())
+
+    if isinstance(value, list) and value and isinstance(value[0], (Instance, list)):
+        return any(_is_modified(item) for item in value)
+
+    return False
+
+
+def _wrap_enum(enum, value):
+    """Wrap the raw integer value of an enum field, or the values of an array of enums."""
+    if isinstance(value, int):
+        return enum._from_int(value)
+
+    if isinstance(value, list):
+        return [enum._from_int(item) if isinstance(item, int) else item for item in value]
+
+    return value
 
 
 class Instance(object):
     """Holds parsed structure data."""
-    __slots__ = ('_type', '_values', '_sizes')
+    __slots__ = ('_type', '_values', '_sizes', '_dirty', '_raw')
 
     def __init__(self, type_, values, sizes=None):
         # Done in this manner to check if the attr is in the lookup
         object.__setattr__(self, '_type', type_)
         object.__setattr__(self, '_values', values)
         object.__setattr__(self, '_sizes', sizes)
+        object.__setattr__(self, '_dirty', None)
+        object.__setattr__(self, '_raw', None)
 
     def __getattr__(self, attr):
         try:
@@ -22,6 +47,7 @@ class Instance(object):
             raise AttributeError("Invalid attribute: %r" % attr)
 
         self._values[attr] = value
+        self._mark_dirty(attr)
 
     def __getitem__(self, item):
         return self._values[item]
@@ -41,9 +67,52 @@ class Instance(object):
         )
 
     def __len__(self):
+        # Nested instances and arrays of them can be modified without this instance knowing
+        if not self._modified_fields():
+            if not self._type._has_bitfields():
+                try:
+                    return len(self._type)
+                except TypeError:
+                    pass
+
+            sizes = self._sizes
+            # Bitfields have no size of their own, so the sizes only add up without them
+            if sizes is not None and len(sizes) == len(self._values):
+                return sum(sizes.values())
+
         return len(self.dumps())
 
+    def _mark_dirty(self, field):
+        """Record that a value was assigned to the given field after reading."""
+        if self._dirty is None:
+            object.__setattr__(self, '_dirty', {field})
+        else:
+            self._dirty.add(field)
+
+    def _modified_fields(self):
+        """Return the names of the fields that were modified after reading.
+
+        Besides assigned fields, these are fields with an instance as value that
+        was modified itself. Other changes to mutable values aren't detected.
+        """
+        modified = set(self._dirty or ())
+        modified.update(name for name, value in self._values.items() if _is_modified(value))
+        return modified
+
+    def _with_raw(self, raw):
+        """Keep the raw bytes this instance was read from, to write them back when unmodified.
+
+        Returns:
+            This instance.
+        """
+        object.__setattr__(self, '_raw', raw)
+        return self
+
     def _size(self, field):
+        if self._sizes is None:
+            # Sizes weren't tracked while reading, so determine it from the type and value
+            return self._type._field_size(field, self[field])
+
         return self._sizes[field]
 
     def write(self, fh):
@@ -63,6 +132,235 @@ class Instance(object):
         Returns:
             The raw bytes of this structure.
         """
-        s = BytesIO()
-        self.write(s)
-        return s.getvalue()
+        return self._type.dumps(self)
+
+
+class CompiledInstance(Instance):
+    """Base class of the instance classes that the compiler generates per structure.
+
+    The values are stored in slots instead of a dict, which saves a lot of memory
+    when many instances are kept around. Subclasses define the slots and the
+    _fields tuple with the names of the values, in order. The _values attribute
+    is still available, as a mapping that reads and writes the slots.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __setattr__(self, attr, value):
+        object.__setattr__(self, attr, value)
+
+        if attr in self._fields:
+            self._mark_dirty(attr)
+
+    @property
+    def _values(self):
+        return SlotValues(self)
+
+    def __getitem__(self, item):
+        if item not in self._fields:
+            raise KeyError(item)
+
+        return getattr(self, item)
+
+    def __contains__(self, attr):
+        return attr in self._fields
+
+
+class SlotValues(MutableMapping):
+    """The values of a CompiledInstance as a mapping, assignments are written to the instance.
+
+    Args:
+        instance: The instance of which to map the values.
+    """
+    __slots__ = ('_instance',)
+
+    def __init__(self, instance):
+        self._instance = instance
+
+    def __getitem__(self, key):
+        return self._instance[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._instance._fields:
+            raise KeyError(key)
+
+        setattr(self._instance, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Values of instances can't be deleted")
+
+    def __iter__(self):
+        return iter(self._instance._fields)
+
+    def __len__(self):
+        return len(self._instance._fields)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, OrderedDict(self.items()))
+
+
+class RawEnumInstance(Instance):
+    """Instance that holds the raw integer values of its enum and flag fields.
+
+    The values are wrapped into enum instances when they are accessed, also
+    through _values. The raw values are kept in _raw_values.
+    """
+    __slots__ = ()
+
+    # The slot of the dict with the values, as read
+    _raw_values = Instance._values
+
+    @property
+    def _values(self):
+        return EnumValues(self._raw_values, self._type._enum_fields())
+
+    @_values.setter
+    def _values(self, values):
+        object.__setattr__(self, '_raw_values', values)
+
+    def __getattr__(self, attr):
+        try:
+            value = self._raw_values[attr]
+        except KeyError:
+            raise AttributeError("Invalid attribute: %r" % attr)
+
+        enum = self._type._enum_fields().get(attr)
+        return value if enum is None else _wrap_enum(enum, value)
+
+    def __getitem__(self, item):
+        value = self._raw_values[item]
+        enum = self._type._enum_fields().get(item)
+        return value if enum is None else _wrap_enum(enum, value)
+
+
+class EnumValues(MutableMapping):
+    """The values of a RawEnumInstance as a mapping, with the raw values of enum fields wrapped.
+
+    Args:
+        values: The dict with the raw values.
+        enums: The enum or flag type of every field that holds one.
+    """
+    __slots__ = ('_raw', '_enums')
+
+    def __init__(self, values, enums):
+        self._raw = values
+        self._enums = enums
+
+    def __getitem__(self, key):
+        value = self._raw[key]
+        enum = self._enums.get(key)
+        return value if enum is None else _wrap_enum(enum, value)
+
+    def __setitem__(self, key, value):
+        self._raw[key] = value
+
+    def __delitem__(self, key):
+        del self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, OrderedDict(self.items()))
+
+
+class EnumField(object):
+    """Descriptor for enum and flag fields of generated instance classes that hold raw values.
+
+    Args:
+        slot: The slot descriptor that holds the raw value.
+        enum: The enum or flag type of the field.
+    """
+    __slots__ = ('slot', 'enum')
+
+    def __init__(self, slot, enum):
+        self.slot = slot
+        self.enum = enum
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        return _wrap_enum(self.enum, self.slot.__get__(obj, objtype))
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+
+class LazyInstance(Instance):
+    """Instance of a statically laid out structure that decodes its values on first access.
+
+    Only the buffer the structure was read from is kept, together with the offset
+    of the structure in it. Values are decoded and cached when they are accessed.
+
+    Args:
+        type_: The structure of this instance.
+        buf: The buffer that contains the structure.
+        offset: The offset of the structure in the buffer.
+    """
+    __slots__ = ('_buf', '_offset', '_decoded')
+
+    def __init__(self, type_, buf, offset=0):
+        object.__setattr__(self, '_type', type_)
+        object.__setattr__(self, '_buf', buf)
+        object.__setattr__(self, '_offset', offset)
+        object.__setattr__(self, '_decoded', {})
+        object.__setattr__(self, '_dirty', None)
+
+    @property
+    def _raw(self):
+        if not self._type.cstruct.keep_raw:
+            return None
+
+        return bytes(self._buf[self._offset:self._offset + len(self._type)])
+
+    def __getattr__(self, attr):
+        try:
+            return self._decoded[attr]
+        except KeyError:
+            pass
+
+        try:
+            offset, type_ = self._type._lazy_layout()[attr]
+        except KeyError:
+            raise AttributeError("Invalid attribute: %r" % attr)
+
+        value = type_.read_from(self._buf, self._offset + offset)[0]
+        self._decoded[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        if attr not in self._type._lazy_layout():
+            raise AttributeError("Invalid attribute: %r" % attr)
+
+        self._decoded[attr] = value
+        self._mark_dirty(attr)
+
+    def __getitem__(self, item):
+        if item not in self._type._lazy_layout():
+            raise KeyError(item)
+
+        return getattr(self, item)
+
+    def __contains__(self, attr):
+        return attr in self._type._lazy_layout()
+
+    @property
+    def _values(self):
+        return OrderedDict((name, getattr(self, name)) for name in self._type._lazy_layout())
+
+    @property
+    def _sizes(self):
+        if not self._type.cstruct.track_sizes:
+            return None
+
+        return {name: len(type_) for name, (_, type_) in self._type._lazy_layout().items()}
+
+    def _modified_fields(self):
+        # Values that weren't decoded yet can't have been modified
+        modified = set(self._dirty or ())
+        modified.update(name for name, value in self._decoded.items() if _is_modified(value))
+        return modified
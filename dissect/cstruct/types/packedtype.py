@@ -1,6 +1,37 @@
+import array
 import struct
+import sys
 
-from dissect.cstruct.types.base import RawType
+from dissect.cstruct.dtype import numpy, packed_dtype
+from dissect.cstruct.types.base import RawType, read_null_terminated
+
+
+def _array_typecode(packchar):
+    """Return the typecode of the array module with the same size and kind as a struct format character."""
+    if packchar in 'fd':
+        candidates = packchar
+    elif packchar in 'bhiq':
+        candidates = 'bhilq'
+    elif packchar in 'BHIQ':
+        candidates = 'BHILQ'
+    else:
+        return None
+
+    size = struct.calcsize('<' + packchar)
+    for typecode in candidates:
+        if array.array(typecode).itemsize == size:
+            return typecode
+
+    return None
+
+
+# Typecodes for reading arrays of packed types into array.array objects, types without one always use lists
+ARRAY_TYPECODES = {packchar: _array_typecode(packchar) for packchar in 'bBhHiIqQfd'}
+
+
+def _is_native(endian):
+    """Return whether values in the given endianness are in the byte order of the host."""
+    return endian in '@=' or (endian == '<') == (sys.byteorder == 'little')
 
 
 class PackedType(RawType):
@@ -11,19 +42,92 @@ class PackedType(RawType):
         self.packchar = packchar
 
     def _read(self, stream):
-        return self._read_array(stream, 1)[0]
+        data = stream.read(self.size)
+
+        if len(data) != self.size:
+            raise EOFError("Read %d bytes, but expected %d" % (len(data), self.size))
+
+        return struct.unpack(self.cstruct.endian + self.packchar, data)[0]
 
     def _read_array(self, stream, count):
         length = self.size * count
         data = stream.read(length)
-        fmt = self.cstruct.endian + str(count) + self.packchar
 
         if len(data) != length:
             raise EOFError("Read %d bytes, but expected %d" % (len(data), length))
 
-        return list(struct.unpack(fmt, data))
+        return self.unpack_array(data)
+
+    def read_from(self, buffer, offset=0):
+        try:
+            value = struct.unpack_from(self.cstruct.endian + self.packchar, buffer, offset)[0]
+        except struct.error:
+            raise EOFError("Read past the end of the buffer at offset %d" % offset)
+
+        return value, offset + self.size
+
+    def unpack_array(self, data):
+        """Unpack the bytes of an array of this type.
+
+        The values are returned as the array type that is configured on the cstruct
+        instance. That is a list by default, an array.array for 'array' and a cast
+        memoryview of the data for 'memoryview'. Memoryviews are only used if the
+        endianness matches the host, array.array is used otherwise. For 'numpy', a
+        read-only numpy.ndarray on top of the data is returned.
+        """
+        array_type = self.cstruct.array_type
+        if array_type == 'numpy':
+            return numpy.frombuffer(data, packed_dtype(self.packchar, self.size, self.cstruct.endian))
+
+        typecode = ARRAY_TYPECODES.get(self.packchar)
+
+        if array_type == 'list' or typecode is None:
+            return list(struct.unpack(self.cstruct.endian + str(len(data) // self.size) + self.packchar, data))
+
+        native = _is_native(self.cstruct.endian) or self.size == 1
+        if array_type == 'memoryview' and native:
+            return memoryview(data).cast(typecode)
+
+        result = array.array(typecode)
+        result.frombytes(data)
+        if not native and self.size > 1:
+            result.byteswap()
+
+        return result
+
+    def pack_array(self, data):
+        """Pack an array of this type into bytes.
+
+        Values in a numpy.ndarray, or an array.array or memoryview with the matching
+        typecode, are copied as a whole, without converting the values one by one.
+        """
+        if numpy is not None and isinstance(data, numpy.ndarray):
+            dtype = packed_dtype(self.packchar, self.size, self.cstruct.endian)
+            return data.astype(dtype, copy=False).tobytes()
+
+        typecode = ARRAY_TYPECODES.get(self.packchar)
+
+        if typecode is not None and (
+            (isinstance(data, array.array) and data.typecode == typecode)
+            or (isinstance(data, memoryview) and data.format == typecode)
+        ):
+            if self.size == 1 or _is_native(self.cstruct.endian):
+                return data.tobytes()
+
+            result = array.array(typecode)
+            result.frombytes(data.tobytes())
+            result.byteswap()
+            return result.tobytes()
+
+        fmt = self.cstruct.endian + str(len(data)) + self.packchar
+        return struct.pack(fmt, *data)
 
     def _read_0(self, stream):
+        if self.packchar not in 'efd':
+            # Only the integer zero consists of null bytes only
+            data = read_null_terminated(stream, self.size)
+            return self.unpack_array(data)
+
         byte_array = []
         while True:
             bytes_stream = stream.read(self.size)
@@ -40,11 +144,10 @@ class PackedType(RawType):
         return self._write_array(stream, [data])
 
     def _write_array(self, stream, data):
-        fmt = self.cstruct.endian + str(len(data)) + self.packchar
-        return stream.write(struct.pack(fmt, *data))
+        return stream.write(self.pack_array(data))
 
     def _write_0(self, stream, data):
-        return self._write_array(stream, data + [0])
+        return self._write_array(stream, list(data) + [0])
 
     def default(self):
         return 0
@@ -1,13 +1,21 @@
+from collections import OrderedDict
+
 from dissect.cstruct.exceptions import NullPointerDereference
 from dissect.cstruct.types.base import Array, RawType
 
 
 class Pointer(RawType):
-    """Implements a pointer to some other type."""
+    """Implements a pointer to some other type.
+
+    Pointers are dereferenced through the address space of the pointer type, or
+    else that of the cstruct instance. Without one, the stream the pointer was
+    read from is read at the address.
+    """
 
-    def __init__(self, cstruct, target):
+    def __init__(self, cstruct, target, address_space=None):
         self.cstruct = cstruct
         self.type = target
+        self.address_space = address_space
         super().__init__(cstruct)
 
     def __len__(self):
@@ -18,17 +26,53 @@ class Pointer(RawType):
 
     def _read(self, stream, ctx):
         addr = self.cstruct.pointer(stream)
-        return PointerInstance(self.type, stream, addr, ctx)
+        return PointerInstance(self.type, stream, addr, ctx, self.address_space)
+
+
+class PointerCache(object):
+    """Cache of the values that pointers in a stream point to, with least recently used eviction.
+
+    Values are keyed by the address and the type they were read as.
+
+    Args:
+        size: The maximum number of values in the cache.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, type_, addr):
+        """Return the cached value of the given type at an address, or None if it isn't cached."""
+        key = (type_, addr)
+        value = self._values.get(key)
+        if value is not None:
+            self._values.move_to_end(key)
+
+        return value
+
+    def put(self, type_, addr, value):
+        """Add the value of the given type at an address, evicting the least recently used value when full."""
+        self._values[(type_, addr)] = value
+        if len(self._values) > self.size:
+            self._values.popitem(last=False)
+
+    def clear(self):
+        self._values.clear()
 
 
 class PointerInstance(object):
     """Like the Instance class, but for structures referenced by a pointer."""
 
-    def __init__(self, type_name, stream, addr, ctx):
+    def __init__(self, type_name, stream, addr, ctx, address_space=None):
         self._stream = stream
         self._type = type_name
         self._addr = addr
         self._ctx = ctx
+        self._address_space = address_space
         self._value = None
 
     def __getattr__(self, attr):
@@ -48,17 +92,47 @@ class PointerInstance(object):
             raise NullPointerDereference()
 
         if self._value is None:
-            # Read current position of file read/write pointer
-            position = self._stream.tell()
-            # Reposition the file read/write pointer
-            self._stream.seek(self._addr)
+            space = self._space()
+            cache = self._cache(space)
+            value = None if cache is None else cache.get(self._type, self._addr)
+
+            if value is None:
+                if space is not None:
+                    value = self._read(space.open(self._addr))
+                else:
+                    # Read current position of file read/write pointer
+                    position = self._stream.tell()
+                    # Reposition the file read/write pointer
+                    self._stream.seek(self._addr)
+                    value = self._read(self._stream)
+                    self._stream.seek(position)
+
+                if cache is not None:
+                    cache.put(self._type, self._addr, value)
 
-            if isinstance(self._type, Array):
-                value = self._type._read(self._stream, self._ctx)
-            else:
-                value = self._type._read(self._stream, )
-
-            self._stream.seek(position)
             self._value = value
 
         return self._value
+
+    def _read(self, stream):
+        if isinstance(self._type, Array):
+            return self._type._read(stream, self._ctx)
+
+        return self._type._read(stream)
+
+    def _space(self):
+        """Return the address space to dereference this pointer through, if any."""
+        if self._address_space is not None:
+            return self._address_space
+
+        cstruct = getattr(self._type, 'cstruct', None)
+        return None if cstruct is None else cstruct.address_space
+
+    def _cache(self, space):
+        """Return the cache of the values pointed to in the address space or stream of this pointer, if any."""
+        if isinstance(self._type, Array) and self._type.dynamic:
+            # The value depends on the structure the pointer is in
+            return None
+
+        cstruct = getattr(self._type, 'cstruct', None)
+        return None if cstruct is None else cstruct.cached_pointers(self._stream if space is None else space)
@@ -2,7 +2,8 @@ from collections import OrderedDict
 from io import BytesIO
 from dissect.cstruct.bitbuffer import BitBuffer
 from dissect.cstruct.types.base import Array, BaseType
-from dissect.cstruct.types.instance import Instance
+from dissect.cstruct.types.enum import Enum, EnumInstance
+from dissect.cstruct.types.instance import Instance, LazyInstance, RawEnumInstance
 from dissect.cstruct.types.pointer import Pointer
 
 
@@ -19,6 +20,19 @@ class Field(object):
         return '<Field {} {}>'.format(self.name, self.type)
 
 
+def _contains_pointer(cstruct, type_):
+    """Return whether reading a value of the given type involves reading a pointer."""
+    type_ = cstruct.resolve(type_)
+
+    if isinstance(type_, Array):
+        return _contains_pointer(cstruct, type_.type)
+
+    if isinstance(type_, Structure):
+        return any(_contains_pointer(cstruct, field.type) for field in type_.fields)
+
+    return isinstance(type_, Pointer)
+
+
 class Structure(BaseType):
     """Type class for structures."""
 
@@ -29,6 +43,9 @@ class Structure(BaseType):
         self.lookup = OrderedDict()
         self.fields = fields
         self.anonymous = anonymous
+        self._layout = None
+        self._enums = None
+        self._bitfields = None
 
         for field in self.fields:
             self.lookup[field.name] = field
@@ -94,12 +111,113 @@ class Structure(BaseType):
 
         return size
 
+    def _lazy_layout(self):
+        """Return the offset and type of every value, for reading lazy instances.
+
+        Only structures with a static layout can be read lazily, other structures
+        result in an empty layout. These are structures with bitfields, pointers or
+        dynamically sized fields.
+
+        Returns:
+            An OrderedDict of value names to (offset, type) tuples.
+        """
+        if self._layout is not None:
+            return self._layout
+
+        layout = OrderedDict()
+        for field in self.fields:
+            field_type = self.cstruct.resolve(field.type)
+            offset = 0 if isinstance(self, Union) else field.offset
+
+            try:
+                len(field_type)
+            except TypeError:
+                layout = None
+                break
+
+            if field.bits or offset is None or _contains_pointer(self.cstruct, field_type):
+                layout = None
+                break
+
+            if isinstance(field_type, Structure) and field_type.anonymous:
+                sub_layout = field_type._lazy_layout()
+                if not sub_layout:
+                    layout = None
+                    break
+
+                for name, (sub_offset, sub_type) in sub_layout.items():
+                    layout[name] = (offset + sub_offset, sub_type)
+            else:
+                layout[field.name] = (offset, field_type)
+
+        self._layout = layout or OrderedDict()
+        return self._layout
+
+    def _has_bitfields(self):
+        """Return whether this structure, or a structure in it, has bitfields.
+
+        The static size of such structures doesn't account for bitfields that are
+        continued after other fields, so it can differ from the size that is read.
+        """
+        if self._bitfields is None:
+            self._bitfields = False
+            for field in self.fields:
+                field_type = field.type
+                while isinstance(field_type, Array):
+                    field_type = field_type.type
+
+                if field.bits or (isinstance(field_type, Structure) and field_type._has_bitfields()):
+                    self._bitfields = True
+                    break
+
+        return self._bitfields
+
+    def _enum_fields(self):
+        """Return the enum or flag type of every value that holds one, or an array of them."""
+        if self._enums is not None:
+            return self._enums
+
+        enums = {}
+        for field in self.fields:
+            field_type = self.cstruct.resolve(field.type)
+
+            if isinstance(field_type, Structure) and field_type.anonymous:
+                enums.update(field_type._enum_fields())
+            elif isinstance(field_type, Array) and isinstance(self.cstruct.resolve(field_type.type), Enum):
+                enums[field.name] = self.cstruct.resolve(field_type.type)
+            elif isinstance(field_type, Enum):
+                enums[field.name] = field_type
+
+        self._enums = enums
+        return self._enums
+
+    def _new_instance(self, values, sizes):
+        """Create the instance of read values, with raw enum values if configured."""
+        if not self.cstruct.raw_enums or not self._enum_fields():
+            return Instance(self, values, sizes)
+
+        for name in self._enum_fields():
+            value = values[name]
+            if isinstance(value, EnumInstance):
+                values[name] = value.value
+            elif isinstance(value, list):
+                values[name] = [item.value if isinstance(item, EnumInstance) else item for item in value]
+
+        return RawEnumInstance(self, values, sizes)
+
     def _read(self, stream, *args, **kwargs):
+        if self.cstruct.lazy and self._lazy_layout():
+            buf = stream.read(len(self))
+            if len(buf) != len(self):
+                raise EOFError()
+
+            return LazyInstance(self, buf)
+
         bit_buffer = BitBuffer(stream, self.cstruct.endian)
         struct_start = stream.tell()
 
         result = OrderedDict()
-        sizes = {}
+        sizes = {} if self.cstruct.track_sizes else None
         for field in self.fields:
             start = stream.tell()
             field_type = self.cstruct.resolve(field.type)
@@ -121,15 +239,39 @@ class Structure(BaseType):
                 v = field_type._read(stream)
 
             if isinstance(field_type, Structure) and field_type.anonymous:
-                sizes.update(v._sizes)
+                if sizes is not None:
+                    sizes.update(v._sizes)
                 result.update(v._values)
             else:
-                sizes[field.name] = stream.tell() - start
+                if sizes is not None:
+                    sizes[field.name] = stream.tell() - start
                 result[field.name] = v
 
-        return Instance(self, result, sizes)
+        instance = self._new_instance(result, sizes)
+        if self.cstruct.keep_raw:
+            end = stream.tell()
+            stream.seek(struct_start)
+            instance._with_raw(stream.read(end - struct_start))
+
+        return instance
+
+    def _read_array(self, stream, count):
+        if self.cstruct.lazy and self._lazy_layout():
+            # All lazy instances share the buffer of the whole array
+            size = len(self)
+            buf = stream.read(max(0, count) * size)
+            if len(buf) != max(0, count) * size:
+                raise EOFError()
+
+            return [LazyInstance(self, buf, offset) for offset in range(0, len(buf), size)]
+
+        return super()._read_array(stream, count)
 
     def _write(self, stream, data):
+        raw = self._dumps_raw(data)
+        if raw is not None:
+            return stream.write(raw)
+
         bit_buffer = BitBuffer(stream, self.cstruct.endian)
         num = 0
 
@@ -154,6 +296,80 @@ class Structure(BaseType):
 
         return num
 
+    def _dumps_raw(self, data):
+        """Dump an instance based on the raw bytes it was read from.
+
+        Unmodified instances result in their raw bytes as they are. Modified fields
+        are encoded and patched into the raw bytes, if they have a static offset
+        and size.
+
+        Returns:
+            The raw bytes of the instance, or None if the instance has to be written
+            field by field.
+        """
+        raw = getattr(data, '_raw', None)
+        if raw is None:
+            return None
+
+        modified = data._modified_fields()
+        if not modified:
+            return raw
+
+        buf = bytearray(raw)
+        for name in modified:
+            field = self.lookup.get(name)
+            if field is None or field.bits:
+                return None
+
+            offset = 0 if isinstance(self, Union) else field.offset
+            if offset is None:
+                return None
+
+            field_type = self.cstruct.resolve(field.type)
+            try:
+                size = len(field_type)
+            except TypeError:
+                return None
+
+            value = field_type.dumps(getattr(data, name))
+            if len(value) != size:
+                return None
+
+            buf[offset:offset + size] = value
+
+        return bytes(buf)
+
+    def _field_size(self, name, value):
+        """Determine the size of a field from its type and value.
+
+        Used for instances that were read without tracking sizes.
+
+        Raises:
+            KeyError: If there's no field with a size of its own by the given name.
+        """
+        for field in self.fields:
+            field_type = self.cstruct.resolve(field.type)
+
+            if isinstance(field_type, Structure) and field_type.anonymous:
+                try:
+                    return field_type._field_size(name, value)
+                except KeyError:
+                    continue
+
+            if field.name != name:
+                continue
+
+            if field.bits:
+                # Bitfields share their storage with other fields
+                break
+
+            try:
+                return len(field_type)
+            except TypeError:
+                return len(field_type.dumps(value))
+
+        raise KeyError(name)
+
     def add_field(self, name, type_, offset=None):
         """Add a field to this structure.
 
@@ -166,6 +382,9 @@ class Structure(BaseType):
         self.fields.append(field)
         self.lookup[name] = field
         self.size = None
+        self._layout = None
+        self._enums = None
+        self._bitfields = None
 
     def default(self):
         """Create and return an empty Instance from this structure.
@@ -210,9 +429,17 @@ class Union(Structure):
         return max(len(field.type) for field in self.fields)
 
     def _read(self, stream):
-        buf = BytesIO(memoryview(stream.read(len(self))))
+        if self.cstruct.lazy and self._lazy_layout():
+            buf = stream.read(len(self))
+            if len(buf) != len(self):
+                raise EOFError()
+
+            return LazyInstance(self, buf)
+
+        raw = stream.read(len(self))
+        buf = BytesIO(memoryview(raw))
         result = OrderedDict()
-        sizes = {}
+        sizes = {} if self.cstruct.track_sizes else None
 
         for field in self.fields:
             start = 0
@@ -229,15 +456,25 @@ class Union(Structure):
                 v = field_type._read(buf)
 
             if isinstance(field_type, Structure) and field_type.anonymous:
-                sizes.update(v._sizes)
+                if sizes is not None:
+                    sizes.update(v._sizes)
                 result.update(v._values)
             else:
-                sizes[field.name] = buf.tell() - start
+                if sizes is not None:
+                    sizes[field.name] = buf.tell() - start
                 result[field.name] = v
 
-        return Instance(self, result, sizes)
+        instance = self._new_instance(result, sizes)
+        if self.cstruct.keep_raw:
+            instance._with_raw(raw)
+
+        return instance
 
     def _write(self, stream, data):
+        raw = self._dumps_raw(data)
+        if raw is not None:
+            return stream.write(raw)
+
         offset = stream.tell()
 
         # Find the largest field
@@ -1,4 +1,4 @@
-from dissect.cstruct.types.base import RawType
+from dissect.cstruct.types.base import RawType, read_null_terminated
 
 
 class WcharType(RawType):
@@ -25,19 +25,7 @@ class WcharType(RawType):
         return data.decode(self.encoding)
 
     def _read_0(self, stream):
-        byte_string = b''
-        while True:
-            bytes_stream = stream.read(2)
-
-            if len(bytes_stream) != 2:
-                raise EOFError()
-
-            if bytes_stream == b'\x00\x00':
-                break
-
-            byte_string += bytes_stream
-
-        return byte_string.decode(self.encoding)
+        return read_null_terminated(stream, 2).decode(self.encoding)
 
     def _write(self, stream, data):
         return stream.write(data.encode(self.encoding))
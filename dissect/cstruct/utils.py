@@ -1,8 +1,16 @@
 import string
 import pprint
 
+from dissect.cstruct.dtype import integer_dtype, numpy, packed_dtype, require_numpy
+from dissect.cstruct.types.base import Array
+from dissect.cstruct.types.bytesinteger import BytesInteger
+from dissect.cstruct.types.chartype import CharType
+from dissect.cstruct.types.enum import Enum
 from dissect.cstruct.types.instance import Instance
-from dissect.cstruct.types.structure import Structure
+from dissect.cstruct.types.packedtype import PackedType
+from dissect.cstruct.types.pointer import Pointer
+from dissect.cstruct.types.structure import Structure, Union
+from dissect.cstruct.types.wchartype import WcharType
 
 COLOR_RED = '\033[1;31m'
 COLOR_GREEN = '\033[1;32m'
@@ -173,3 +181,110 @@ def dumpstruct(obj_dump, data=None, offset=0, color=True, output='print'):
         return _dumpstruct(obj_dump(data), obj_dump, color, data, output, offset)
     else:
         raise ValueError("Invalid arguments")
+
+
+def _type_dtype(cstruct, type_):
+    """Return the NumPy dtype of a statically sized type, see structure_dtype()."""
+    type_ = cstruct.resolve(type_)
+
+    if isinstance(type_, Structure):
+        return structure_dtype(type_)
+
+    if isinstance(type_, Enum):
+        return _type_dtype(cstruct, type_.type)
+
+    if isinstance(type_, Pointer):
+        return _type_dtype(cstruct, cstruct.pointer)
+
+    if isinstance(type_, PackedType):
+        return packed_dtype(type_.packchar, type_.size, cstruct.endian)
+
+    if isinstance(type_, BytesInteger):
+        if type_.size in (1, 2, 4, 8):
+            return integer_dtype(type_.size, type_.signed, cstruct.endian)
+        return numpy.dtype((numpy.uint8, (type_.size,)))
+
+    if isinstance(type_, CharType):
+        return numpy.dtype('S1')
+
+    if isinstance(type_, WcharType):
+        return numpy.dtype('S2')
+
+    if isinstance(type_, Array) and not type_.dynamic and not type_.null_terminated:
+        item_type = cstruct.resolve(type_.type)
+
+        if isinstance(item_type, CharType):
+            return numpy.dtype('S{:d}'.format(type_.count))
+
+        if isinstance(item_type, WcharType):
+            return numpy.dtype('S{:d}'.format(type_.count * 2))
+
+        return numpy.dtype((_type_dtype(cstruct, item_type), (type_.count,)))
+
+    raise TypeError(f"Type can't be represented as a NumPy dtype: {type_}")
+
+
+def structure_dtype(structure):
+    """Return a NumPy structured dtype with the layout of a statically sized structure.
+
+    A table of records can then be parsed at once with numpy.frombuffer() or
+    numpy.memmap(), instead of reading every record into an Instance.
+
+    Fields of nested structures and unions are nested structured dtypes, except
+    for anonymous ones, whose fields are included directly. Arrays become
+    subarrays. Some types are represented by their raw values:
+
+    - Enums and flags by their underlying integer type, see wrap_enum().
+    - Pointers by their address.
+    - Strings by their bytes, which are still UTF-16 encoded for wchar.
+    - Integers of sizes without a NumPy type, such as uint24, by an array of
+      their bytes. BytesInteger.unpack_array() converts these.
+
+    Raises:
+        ImportError: If NumPy isn't installed.
+        TypeError: If the structure has bitfields or fields without a static size.
+    """
+    require_numpy()
+
+    names = []
+    formats = []
+    offsets = []
+
+    for field in structure.fields:
+        offset = 0 if isinstance(structure, Union) else field.offset
+        if field.bits or offset is None:
+            raise TypeError(f"Field can't be represented in a NumPy dtype: {field.name}")
+
+        field_dtype = _type_dtype(structure.cstruct, field.type)
+        field_type = structure.cstruct.resolve(field.type)
+
+        if isinstance(field_type, Structure) and field_type.anonymous:
+            for name, (sub_dtype, sub_offset) in field_dtype.fields.items():
+                names.append(name)
+                formats.append(sub_dtype)
+                offsets.append(offset + sub_offset)
+            continue
+
+        names.append(field.name)
+        formats.append(field_dtype)
+        offsets.append(offset)
+
+    return numpy.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': len(structure),
+    })
+
+
+def wrap_enum(enum, values):
+    """Wrap the raw integer values of an enum or flag, e.g. from a structured NumPy array.
+
+    Args:
+        enum: The Enum or Flag type of the values.
+        values: An iterable of integers, such as a column of a structured array.
+
+    Returns:
+        A list of EnumInstance or FlagInstance objects.
+    """
+    return [enum(int(value)) for value in values]
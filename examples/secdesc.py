@@ -52,8 +52,8 @@ struct ACCESS_ALLOWED_ACE {
 struct ACCESS_ALLOWED_OBJECT_ACE {
     uint32  Mask;
     uint32  Flags;
-    char    ObjectType[Flags & 1 * 16];
-    char    InheritedObjectType[Flags & 2 * 8];
+    char    ObjectType[(Flags & 1) * 16];
+    char    InheritedObjectType[(Flags & 2) * 8];
     LDAP_SID Sid;
 };
 """
@@ -0,0 +1,103 @@
+from io import BytesIO
+
+import pytest
+
+from dissect import cstruct
+
+
+DEFINITION = """
+struct node {
+    uint16  value;
+};
+
+struct root {
+    node    *a;
+    node    *b;
+    char    *name[4];
+};
+"""
+
+
+class CountingIO(BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_paged_address_space():
+    fh = CountingIO(b'AAAABBBBCCCCDD')
+    # Pages 0x1000, 0x1004 and 0x1008 are stored in reverse order, the pages after them aren't mapped
+    space = cstruct.PagedAddressSpace(fh, {0x1004: 4, 0x1000: 8, 0x1008: 0}.get, page_size=4, cache_size=2)
+
+    assert space.read(0x1002, 6) == b'CCBBBB'
+    assert fh.reads == 2
+    assert space.read(0x1004, 2) == b'BB'
+    assert fh.reads == 2
+
+    assert space.read(0x1008, 4) == b'AAAA'
+    assert space.read(0x1000, 1) == b'C'
+    assert fh.reads == 4
+
+    with pytest.raises(cstruct.AddressError):
+        space.read(0x2000, 1)
+
+    # Reads that run into an unmapped page are short
+    assert space.read(0x100a, 4) == b'AA'
+
+    with pytest.raises(ValueError):
+        cstruct.PagedAddressSpace(fh, None, page_size=3)
+
+
+def test_address_space_stream():
+    stream = cstruct.FileAddressSpace(BytesIO(b'0123456789')).open(2)
+    assert stream.read(3) == b'234'
+    assert stream.tell() == 5
+    stream.seek(-2, 1)
+    assert stream.read(2) == b'34'
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_pointer_address_space(compiled):
+    image = CountingIO(b'\x2a\x00\x07\x00test')
+    space = cstruct.PagedAddressSpace(image, lambda addr: addr - 0x8000 if addr == 0x8000 else None, page_size=0x100)
+
+    c = cstruct.cstruct(pointer='uint16', address_space=space)
+    c.load(DEFINITION, compiled=compiled)
+
+    root = c.root(b'\x00\x80\x02\x80\x04\x80')
+    assert root.a.value == 0x2a
+    assert root.b.value == 7
+    assert root.name._get() == b'test'
+    assert image.reads == 1
+
+    with pytest.raises(cstruct.AddressError):
+        c.root(b'\x00\x90\x00\x00\x00\x00').a.value
+
+    # The address space of a pointer type takes precedence over that of the cstruct instance
+    other = cstruct.FileAddressSpace(BytesIO(b'\x00\x00\x05\x00'))
+    c.root.fields[0].type.address_space = other
+    assert c.root(b'\x02\x00\x02\x80\x04\x80').a.value == 5
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_pointer_address_space_unmapped_end(compiled):
+    # The string ends right before the unmapped page that follows it
+    image = BytesIO(b'\x00' * 0xf8 + b'test\x00\x00\x00\x00')
+    space = cstruct.PagedAddressSpace(image, {0x8000: 0}.get, page_size=0x100)
+
+    c = cstruct.cstruct(pointer='uint16', address_space=space)
+    c.load("""
+    struct str {
+        char    s[];
+    };
+
+    struct holder {
+        str     *p;
+    };
+    """, compiled=compiled)
+
+    assert c.holder(b'\xf8\x80').p.s == b'test'
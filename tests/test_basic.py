@@ -1,4 +1,7 @@
+import array
 import os
+import struct
+import sys
 import pytest
 from io import BytesIO
 
@@ -20,6 +23,48 @@ def test_simple_types():
         c.wchar[None](b'a\x00a\x00a')
 
 
+@pytest.mark.parametrize('compiled', [True, False])
+def test_null_terminated_chunked(compiled):
+    d = """
+    struct test {
+        char    a[];
+        wchar   b[];
+        uint32  c[];
+        uint24  d[];
+        uint8   e;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    # Long enough to span multiple chunks, with null bytes that aren't aligned to an element
+    a = b'a' * 1000
+    b = 'a\u0100' * 500
+    c_ = [0x100, 0x1000000] * 300
+    d_ = [0x10000, 0x100] * 300
+
+    buf = a + b'\x00' + b.encode('utf-16-le') + b'\x00\x00'
+    buf += b''.join(v.to_bytes(4, 'little') for v in c_) + b'\x00' * 4
+    buf += b''.join(v.to_bytes(3, 'little') for v in d_) + b'\x00' * 3
+    buf += b'\xff'
+
+    fh = BytesIO(buf + b'\x01')
+    obj = c.test(fh)
+    assert obj.a == a
+    assert obj.b == b
+    assert obj.c == c_
+    assert obj.d == d_
+    assert obj.e == 0xff
+    assert fh.tell() == len(buf)
+    assert obj.dumps() == buf
+
+    with pytest.raises(EOFError):
+        c.test(buf[:1000])
+
+    with pytest.raises(EOFError):
+        c.uint32[None](b'\x01\x00\x00\x00\x00\x00')
+
+
 @pytest.mark.parametrize('compiled', [True, False])
 def test_simple_struct(compiled):
     d = """
@@ -92,6 +137,38 @@ def test_simple_struct_be(compiled):
     assert d == a.dumps()
 
 
+def test_compiled_endian_change():
+    d = """
+    struct test {
+        uint16  a;
+        wchar   b[2];
+        uint24  c;
+        uint16  d[2];
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=True)
+
+    buf = b'\x01\x00a\x00b\x00\x02\x00\x00\x03\x00\x04\x00'
+    a = c.test(buf)
+    assert a.a == 1
+    assert a.b == 'ab'
+    assert a.c == 2
+    assert a.d == [3, 4]
+    assert "struct.Struct('<" in c.test.source
+
+    c.endian = '>'
+    buf = b'\x00\x01\x00a\x00b\x00\x00\x02\x00\x03\x00\x04'
+    a = c.test(buf)
+    assert '+compiled' in repr(c.test)
+    assert a.a == 1
+    assert a.b == 'ab'
+    assert a.c == 2
+    assert a.d == [3, 4]
+    assert a.dumps() == buf
+    assert "struct.Struct('>" in c.test.source
+
+
 def test_bytes_integer_unsigned():
     c = cstruct.cstruct()
 
@@ -153,6 +230,24 @@ def test_bytes_integer_signed_be():
     assert int40[2](b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xfe') == [-1, -2]
 
 
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_bytes_integer_bulk(endian):
+    c = cstruct.cstruct()
+    c.endian = endian
+
+    values = [0, 1, -1, 0x7fffff, -0x800000, 0x123456, -0x123456] * 10
+    buf = b''.join(v.to_bytes(3, 'little' if endian == '<' else 'big', signed=True) for v in values)
+    assert c.int24[len(values)](buf) == values
+    assert c.int24[len(values)].dumps(values) == buf
+    assert c.uint24[len(values)](buf) == [v & 0xffffff for v in values]
+    assert c.uint24[len(values)].dumps([v & 0xffffff for v in values]) == buf
+
+    values = [0, 1, 0xffffffffffff, 0x123456789abc] * 10
+    buf = b''.join(v.to_bytes(6, 'little' if endian == '<' else 'big') for v in values)
+    assert c.uint48[len(values)](buf) == values
+    assert c.uint48[len(values)].dumps(values) == buf
+
+
 @pytest.mark.parametrize('compiled', [True, False])
 def test_bytes_integer_struct_signed(compiled):
     d = """
@@ -548,6 +643,47 @@ def test_bitfield_be(compiled):
     assert a.dumps() == d
 
 
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_bitfield_static(endian):
+    d = """
+    struct flags {
+        uint8   a:1;
+        uint8   b:3;
+        uint8   c:4;
+        uint32  d:20;
+        uint32  e:12;
+        int8    f:6;
+        int8    g:2;
+    };
+
+    struct test {
+        uint16  x;
+        flags   y;
+        uint64  z:33;
+        uint64  w:31;
+    };
+    """
+    c = cstruct.cstruct(endian=endian)
+    c.load(d, compiled=True)
+    i = cstruct.cstruct(endian=endian)
+    i.load(d, compiled=False)
+
+    assert 'bitreader.read' not in c.flags.source
+    assert 'bitreader.read' not in c.test.source
+    assert '_read(stream)' not in c.test.source
+
+    buf = bytes(range(0x80, 0x80 + 16))
+    a = c.test(buf)
+    b = i.test(buf)
+
+    for name in ('a', 'b', 'c', 'd', 'e', 'f', 'g'):
+        assert getattr(a.y, name) == getattr(b.y, name)
+    assert (a.x, a.z, a.w) == (b.x, b.z, b.w)
+    assert a._sizes == b._sizes
+    assert a.y._sizes == b.y._sizes
+    assert a.dumps() == buf
+
+
 def test_write():
     c = cstruct.cstruct()
 
@@ -652,7 +788,7 @@ def test_write_bitfield(compiled):
     };
     """
     c = cstruct.cstruct()
-    c.load(d, compiled=False)
+    c.load(d, compiled=compiled)
 
     a = c.test()
     a.a = 0b1
@@ -688,6 +824,51 @@ def test_write_bitfield_be(compiled):
     assert a.dumps() == b'\xc0\x00\x00\x00\x00\xff\xf8\x00'
 
 
+@pytest.mark.parametrize('compiled', [True, False])
+def test_write_mixed_struct(compiled):
+    d = """
+    enum Test24 : uint24 {
+        A = 0x1,
+        B = 0x2
+    };
+
+    struct inner {
+        uint32  a;
+        char    b[2];
+    };
+
+    struct test {
+        char    magic[4];
+        Test24  e;
+        uint24  i[2];
+        uint16  a:4;
+        uint16  b:12;
+        inner   nested[2];
+        uint8   count;
+        uint16  dynamic[count];
+        uint32  list[2];
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    buf = (
+        b'test\x02\x00\x00\x01\x00\x00\x02\x00\x00\x21\x43\x01\x00\x00\x00ab\x02\x00\x00\x00cd'
+        b'\x02\x01\x00\x02\x00\x03\x00\x00\x00\x04\x00\x00\x00'
+    )
+    a = c.test(buf)
+    assert a.dumps() == buf
+
+    f = BytesIO()
+    assert a.write(f) == len(buf)
+    assert f.getvalue() == buf
+
+    # Array sizes are not enforced when writing
+    a.magic = b'ab'
+    a.list = [1]
+    assert a.dumps() == b'ab' + buf[4:-8] + b'\x01\x00\x00\x00'
+
+
 @pytest.mark.parametrize('compiled', [True, False])
 def test_write_enum(compiled):
     d = """
@@ -919,12 +1100,16 @@ def test_expressions(compiled):
     #define const 1
     struct test {
         uint8   flag;
-        uint8   data_1[flag & 1 * 4];
+        uint8   data_1[(flag & 1) * 4];
         uint8   data_2[flag & (1 << 2)];
         uint8   data_3[const];
     };
     """, compiled=compiled)
 
+    if compiled:
+        # Expressions are translated to Python code when compiling
+        assert 'Expression' not in c.test.source
+
     a = c.test(b'\x01\x00\x01\x02\x03\xff')
     assert a.flag == 1
     assert a.data_1 == [0, 1, 2, 3]
@@ -1144,6 +1329,52 @@ def test_anonymous_union_struct(compiled):
     assert a.dumps() == b
 
 
+@pytest.mark.parametrize('compiled', [True, False])
+def test_union_members(compiled):
+    d = """
+    enum Test16 : uint16 {
+        A = 0x1,
+        B = 0x2
+    };
+
+    union test {
+        uint32  a;
+        char    b[8];
+        uint16  c[4];
+        wchar   d[2];
+        Test16  e;
+        struct {
+            uint8   f;
+            uint8   g;
+        };
+        struct {
+            uint16  h;
+        } i;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    if compiled:
+        assert '+compiled' in repr(c.test)
+
+    a = c.test(b'\x01\x00o\x00beef')
+    assert a.a == 0x6f0001
+    assert a.b == b'\x01\x00o\x00beef'
+    assert a.c == [0x1, 0x6f, 0x6562, 0x6665]
+    assert a.d == '\x01o'
+    assert a.e == c.Test16.A
+    assert a.f == 0x1
+    assert a.g == 0x0
+    assert a.i.h == 0x1
+    assert a._size('a') == 4
+    assert a._size('b') == 8
+    assert a._size('i') == 2
+
+    with pytest.raises(EOFError):
+        c.test(b'\x01\x00')
+
+
 @pytest.mark.parametrize('compiled', [True, False])
 def test_config_flag_nocompile(compiled):
     d = """
@@ -1286,3 +1517,891 @@ def test_half_compiled_struct():
     assert obj.c == 4
 
     assert obj.dumps() == buf
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_nested_struct_static(compiled):
+    d = """
+    struct point {
+        uint16  x;
+        uint16  y;
+    };
+
+    struct test {
+        uint8   a;
+        point   b;
+        point   c[2];
+        char    d[2];
+        struct {
+            uint8   e;
+            uint8   f;
+        };
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    if compiled:
+        assert '_read(stream)' not in c.test.source
+
+    buf = b'\x01\x02\x00\x03\x00\x04\x00\x05\x00\x06\x00\x07\x00ab\x08\x09'
+    obj = c.test(buf)
+    assert obj.a == 1
+    assert obj.b.x == 2
+    assert obj.b.y == 3
+    assert [(p.x, p.y) for p in obj.c] == [(4, 5), (6, 7)]
+    assert obj.d == b'ab'
+    assert obj.e == 8
+    assert obj.f == 9
+    assert len(obj) == len(buf)
+    assert obj._sizes['c'] == 8
+    assert obj.b._sizes == {'x': 2, 'y': 2}
+
+    assert obj.dumps() == buf
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_struct_array_bulk_read(compiled):
+    d = """
+    struct point {
+        uint16  x;
+        uint8   y[2];
+    };
+
+    struct test {
+        uint8   count;
+        point   points[count];
+        uint8   end;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    if compiled:
+        assert 'iter_unpack' in c.point.source
+        assert 'iter_unpack' in c.test.source
+
+    buf = b'\x02\x01\x00\x02\x03\x04\x00\x05\x06\xff'
+    obj = c.test(buf)
+    assert [(p.x, p.y) for p in obj.points] == [(1, [2, 3]), (4, [5, 6])]
+    assert obj.points[1]._sizes == {'x': 2, 'y': 2}
+    assert obj._sizes['points'] == 8
+    assert obj.end == 0xff
+    assert obj.dumps() == buf
+
+    points = c.point[2](buf[1:9])
+    assert [(p.x, p.y) for p in points] == [(1, [2, 3]), (4, [5, 6])]
+    assert c.point[0](b'') == []
+
+    with pytest.raises(EOFError):
+        c.point[3](buf[1:9])
+
+    with pytest.raises(EOFError):
+        c.test(b'\x03' + buf[1:9])
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_read_from(compiled):
+    d = """
+    struct record {
+        uint16  a;
+        char    b[2];
+        uint8   c[2];
+    };
+
+    struct dynamic {
+        uint8   size;
+        char    data[size];
+    };
+
+    struct ptrtest {
+        uint8   pad;
+        record  *ptr;
+    };
+    """
+    c = cstruct.cstruct(pointer='uint8')
+    c.load(d, compiled=compiled)
+
+    if compiled:
+        assert 'unpack_from(buffer, offset)' in c.record.source
+
+    buf = b'\x00\x01\x00ab\x02\x03\x04\x00cd\x05\x06'
+    for buffer in (buf, bytearray(buf), memoryview(buf)):
+        obj, offset = c.record.read_from(buffer, 1)
+        assert (obj.a, obj.b, obj.c) == (1, b'ab', [2, 3])
+        assert offset == 7
+
+        obj, offset = c.record.read_from(buffer, offset)
+        assert (obj.a, obj.b, obj.c) == (4, b'cd', [5, 6])
+        assert offset == len(buf)
+
+        with pytest.raises(EOFError):
+            c.record.read_from(buffer, offset)
+
+    assert c.uint16.read_from(buf, 1) == (1, 3)
+    assert c.char[2].read_from(buf, 3) == (b'ab', 5)
+
+    obj, offset = c.dynamic.read_from(b'\xff\x03abcd', 1)
+    assert obj.data == b'abc'
+    assert offset == 5
+
+    # Pointers are relative to the start of the buffer, not the offset
+    obj, offset = c.ptrtest.read_from(memoryview(b'\xff\xff\x03\x01\x00ab\x02\x03'), 1)
+    assert offset == 3
+    assert obj.ptr.a == 1
+    assert obj.ptr.c == [2, 3]
+
+
+def test_compiled_instance():
+    d = """
+    struct point {
+        uint16  x;
+        uint16  y;
+    };
+
+    struct test {
+        uint8   a;
+        point   b;
+        char    c[a];
+    };
+
+    struct reserved {
+        uint8   write;
+        uint8   _type;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=True)
+
+    buf = b'\x02\x01\x00\x02\x00ab'
+    obj = c.test(buf)
+    assert isinstance(obj, cstruct.CompiledInstance)
+    assert isinstance(obj.b, cstruct.CompiledInstance)
+    assert not hasattr(obj, '__dict__')
+    assert type(obj).__name__ == 'test_Instance'
+    assert type(obj.b).__qualname__ == 'point_Instance'
+
+    assert obj._values == {'a': 2, 'b': obj.b, 'c': b'ab'}
+    assert list(obj._values) == ['a', 'b', 'c']
+    assert obj._size('c') == 2
+    assert obj.b._sizes == {'x': 2, 'y': 2}
+    assert obj['a'] == 2
+    assert 'c' in obj
+    assert 'd' not in obj
+    assert repr(obj) == "<test a=0x2, b=<point x=0x1, y=0x2>, c=b'ab'>"
+    assert obj.dumps() == buf
+
+    with pytest.raises(KeyError):
+        obj['d']
+
+    with pytest.raises(AttributeError):
+        obj.d
+
+    with pytest.raises(AttributeError):
+        obj.d = 1
+
+    obj.b.y = 3
+    assert obj.dumps() == b'\x02\x01\x00\x03\x00ab'
+
+    # Assignments through _values are written to the instance
+    obj._values['a'] = 5
+    assert obj.a == 5
+    assert 'a' in obj._modified_fields()
+    assert obj.dumps() == b'\x05\x01\x00\x03\x00ab'
+
+    with pytest.raises(KeyError):
+        obj._values['d'] = 1
+
+    # Field names that clash with the Instance API keep using a regular Instance
+    obj = c.reserved(b'\x01\x02')
+    assert not isinstance(obj, cstruct.CompiledInstance)
+    assert obj._values == {'write': 1, '_type': 2}
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_track_sizes_disabled(compiled):
+    d = """
+    struct point {
+        uint16  x;
+        uint16  y;
+    };
+
+    struct test {
+        uint8   a;
+        uint8   b:4;
+        uint8   c:4;
+        point   d;
+        char    e[a];
+        char    f[];
+        struct {
+            uint16  g;
+        };
+    };
+    """
+    c = cstruct.cstruct(track_sizes=False)
+    c.load(d, compiled=compiled)
+
+    if compiled:
+        assert 'stream.tell()' not in c.test.source
+        assert 'sizes[' not in c.test.source
+
+    buf = b'\x02\x21\x01\x00\x02\x00abcd\x00\x03\x00'
+    obj = c.test(buf)
+    assert obj._sizes is None
+    assert obj.d._sizes is None
+    assert obj.f == b'cd'
+    assert obj.g == 3
+
+    assert obj._size('a') == 1
+    assert obj._size('d') == 4
+    assert obj._size('e') == 2
+    assert obj._size('f') == 3
+    assert obj._size('g') == 2
+    assert obj.d._size('y') == 2
+
+    with pytest.raises(KeyError):
+        obj._size('b')
+
+    assert dumpstruct(obj.d, output='string')
+
+    c.track_sizes = True
+    obj = c.test(buf)
+    assert obj._sizes['f'] == 3
+    assert obj.d._size('y') == 2
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_lazy(compiled):
+    d = """
+    struct point {
+        uint16  x;
+        uint16  y;
+    };
+
+    struct record {
+        uint32  a;
+        char    b[4];
+        point   c;
+        point   d[2];
+        struct {
+            uint8   e;
+            uint8   f;
+        };
+    };
+
+    struct dynamic {
+        uint8   count;
+        record  records[count];
+    };
+
+    struct bits {
+        uint8   a:4;
+        uint8   b:4;
+    };
+    """
+    c = cstruct.cstruct(lazy=True)
+    c.load(d, compiled=compiled)
+
+    buf = b'\x01\x00\x00\x00abcd\x02\x00\x03\x00\x04\x00\x05\x00\x06\x00\x07\x00\x08\x09'
+    obj = c.record(buf)
+    assert isinstance(obj, cstruct.LazyInstance)
+    assert obj._decoded == {}
+
+    assert obj.b == b'abcd'
+    assert list(obj._decoded) == ['b']
+    assert obj.c.y == 3
+    assert isinstance(obj.c, cstruct.LazyInstance)
+    assert [p.x for p in obj.d] == [4, 6]
+    assert obj.f == 9
+    assert obj['a'] == 1
+    assert 'e' in obj
+    assert list(obj._values) == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert obj._sizes == {'a': 4, 'b': 4, 'c': 4, 'd': 8, 'e': 1, 'f': 1}
+    assert obj._size('d') == 8
+    assert obj.dumps() == buf
+
+    with pytest.raises(AttributeError):
+        obj.g
+
+    obj.a = 2
+    assert obj.dumps() == b'\x02' + buf[1:]
+
+    # Records in an array share the buffer they were read with
+    records = c.dynamic(b'\x02' + buf + buf).records
+    assert [r._offset for r in records] == [0, len(buf)]
+    assert records[0]._buf is records[1]._buf
+    assert records[1].c.x == 2
+
+    obj, offset = c.record.read_from(memoryview(b'\x00' + buf), 1)
+    assert offset == len(buf) + 1
+    assert obj.c.x == 2
+
+    with pytest.raises(EOFError):
+        c.record(buf[:-1])
+
+    with pytest.raises(EOFError):
+        c.record.read_from(buf, 1)
+
+    # Structures without a static layout are read as usual
+    assert not isinstance(c.dynamic(b'\x00'), cstruct.LazyInstance)
+    assert not isinstance(c.bits(b'\x21'), cstruct.LazyInstance)
+    assert c.bits(b'\x21').b == 2
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_lazy_union(compiled):
+    d = """
+    union test {
+        uint32  a;
+        uint16  b[2];
+        char    c[4];
+    };
+    """
+    c = cstruct.cstruct(lazy=True)
+    c.load(d, compiled=compiled)
+
+    obj = c.test(b'\x01\x00\x02\x00')
+    assert isinstance(obj, cstruct.LazyInstance)
+    assert obj.b == [1, 2]
+    assert obj.a == 0x20001
+    assert obj.c == b'\x01\x00\x02\x00'
+    assert [u.a for u in c.test[2](b'\x01\x00\x00\x00\x02\x00\x00\x00')] == [1, 2]
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_instance_len(compiled, monkeypatch):
+    d = """
+    struct header {
+        uint16  a;
+        char    b[2];
+    };
+
+    struct test {
+        header  hdr;
+        uint8   len;
+        char    data[len];
+        uint16  flags:4;
+        uint16  other:12;
+    };
+
+    struct record {
+        header  hdr;
+        uint8   len;
+        char    data[len];
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    hdr = c.header(b'\x01\x00ab')
+    record = c.record(b'\x01\x00ab\x03xyz')
+    bits = c.test(b'\x01\x00ab\x03xyz\x00\x00')
+
+    def dumps(data):
+        raise AssertionError("Unexpected serialization")
+
+    monkeypatch.setattr(c.header, 'dumps', dumps)
+    monkeypatch.setattr(c.record, 'dumps', dumps)
+    assert len(hdr) == 4
+    assert len(record) == 8
+    monkeypatch.undo()
+
+    # Bitfields have no recorded size
+    assert len(bits) == 10
+
+    record.data = b'longer'
+    assert len(record) == 11
+
+    record = c.record(b'\x01\x00ab\x03xyz')
+    record.hdr.b = b'abcd'
+    assert len(record) == 10
+
+    c.track_sizes = False
+    record = c.record(b'\x01\x00ab\x03xyz')
+    assert record._sizes is None
+    assert len(record) == 8
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_instance_len_nested_changes(compiled):
+    d = """
+    struct item {
+        char    s[2];
+    };
+
+    struct test {
+        item    one;
+        item    arr[2];
+        uint16  x;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    buf = b'ab' + b'cdef' + b'\x01\x00'
+    obj = c.test(buf)
+    assert len(obj) == 8
+
+    obj.one.s = b'wxyz'
+    assert len(obj) == len(obj.dumps()) == 10
+
+    obj = c.test(buf)
+    obj.arr[0].s = b'xyz'
+    assert len(obj) == len(obj.dumps()) == 9
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_instance_len_bitfields(compiled):
+    d = """
+    struct split {
+        uint32  a:4;
+        uint8   b;
+        uint32  c:4;
+    };
+
+    struct widths {
+        uint16  a:4;
+        uint16  b:4;
+        uint32  c;
+        uint16  d:12;
+    };
+
+    struct outer {
+        uint8   x;
+        split   inner;
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    split = c.split(b'\x01\x00\x00\x00\x02\x03\x00\x00\x00')
+    assert len(split.dumps()) == 9
+    assert len(split) == 9
+
+    widths = c.widths(b'\x00' * 8)
+    assert len(widths.dumps()) == 8
+    assert len(widths) == 8
+
+    outer = c.outer(b'\x05' + split.dumps())
+    assert len(outer) == 10
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_keep_raw(compiled, monkeypatch):
+    d = """
+    struct header {
+        uint16  a;
+        uint8   b;
+    };
+
+    struct test {
+        header  hdr;
+        uint32  value;
+        uint8   len;
+        char    data[len];
+    };
+
+    union view {
+        uint32  a;
+        uint16  b[2];
+    };
+    """
+    c = cstruct.cstruct(keep_raw=True)
+    c.load(d, compiled=compiled)
+
+    buf = b'\x01\x00\x02\x03\x00\x00\x00\x03xyz'
+    obj = c.test(buf)
+    assert obj._raw == buf
+    assert obj.hdr._raw in (None, buf[:3])
+
+    def write(stream, data):
+        raise AssertionError("Unexpected field write")
+
+    # Unmodified instances are written as they were read
+    monkeypatch.setattr(c.uint32, '_write', write)
+    assert obj.dumps() == buf
+    monkeypatch.undo()
+
+    obj.value = 4
+    assert obj.dumps() == b'\x01\x00\x02\x04\x00\x00\x00\x03xyz'
+
+    obj.hdr.b = 5
+    assert obj.dumps() == b'\x01\x00\x05\x04\x00\x00\x00\x03xyz'
+
+    obj.data = b'ab'
+    assert obj.dumps() == b'\x01\x00\x05\x04\x00\x00\x00\x03ab'
+    assert obj._raw == buf
+
+    obj = c.view(b'\x01\x00\x02\x00')
+    obj.b = [3, 4]
+    assert obj.dumps() == b'\x03\x00\x04\x00'
+
+    objs = c.test[2](buf * 2)
+    assert [o._raw for o in objs] == [buf, buf]
+    assert c.test.read_from(buf)[0]._raw == buf
+
+    c.keep_raw = False
+    assert c.test(buf)._raw is None
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+@pytest.mark.parametrize('array_type', ['array', 'memoryview'])
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_array_type(compiled, array_type, endian):
+    d = """
+    struct test {
+        uint8   a[4];
+        uint16  len;
+        uint32  b[len];
+        double  c[2];
+        uint16  d[];
+        uint24  e[2];
+    };
+    """
+    c = cstruct.cstruct(endian=endian, array_type=array_type)
+    c.load(d, compiled=compiled)
+
+    buf = b''.join([
+        bytes([1, 2, 3, 4]),
+        (2).to_bytes(2, 'little' if endian == '<' else 'big'),
+        struct.pack(endian + '2I2d', 5, 6, 1.5, -2.0),
+        struct.pack(endian + '3H', 7, 8, 0),
+        (9).to_bytes(3, 'little' if endian == '<' else 'big') * 2,
+    ])
+    obj = c.test(buf)
+
+    native = (endian == '<') == (sys.byteorder == 'little')
+    expected = memoryview if array_type == 'memoryview' and native else array.array
+    assert isinstance(obj.a, memoryview if array_type == 'memoryview' else array.array)
+    assert isinstance(obj.b, expected)
+    assert isinstance(obj.c, expected)
+    assert isinstance(obj.d, expected)
+    assert isinstance(obj.e, list)
+
+    assert list(obj.a) == [1, 2, 3, 4]
+    assert list(obj.b) == [5, 6]
+    assert list(obj.c) == [1.5, -2.0]
+    assert list(obj.d) == [7, 8]
+    assert obj.e == [9, 9]
+    assert obj.dumps() == buf
+
+    obj.b = array.array(obj.b.typecode if isinstance(obj.b, array.array) else obj.b.format, [10, 11])
+    assert c.test(obj.dumps()).b.tolist() == [10, 11]
+    obj.b = [12, 13]
+    assert c.test(obj.dumps()).b.tolist() == [12, 13]
+
+    with pytest.raises(ValueError):
+        c.array_type = 'tuple'
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_array_type_numpy(compiled, endian):
+    numpy = pytest.importorskip('numpy')
+
+    d = """
+    struct test {
+        uint16  len;
+        uint32  a[len];
+        float   b[2];
+        int24   c[2];
+        uint48  d[len];
+        uint16  e[];
+    };
+    """
+    c = cstruct.cstruct(endian=endian, array_type='numpy')
+    c.load(d, compiled=compiled)
+
+    byteorder = 'little' if endian == '<' else 'big'
+    buf = b''.join([
+        (2).to_bytes(2, byteorder),
+        struct.pack(endian + '2I2f', 5, 6, 1.5, -2.0),
+        (-3).to_bytes(3, byteorder, signed=True) + (3).to_bytes(3, byteorder, signed=True),
+        (0x123456789abc).to_bytes(6, byteorder) * 2,
+        struct.pack(endian + '3H', 7, 8, 0),
+    ])
+    obj = c.test(buf)
+
+    for value in (obj.a, obj.b, obj.c, obj.d, obj.e):
+        assert isinstance(value, numpy.ndarray)
+
+    assert obj.a.tolist() == [5, 6]
+    assert obj.b.tolist() == [1.5, -2.0]
+    assert obj.c.tolist() == [-3, 3]
+    assert obj.d.tolist() == [0x123456789abc, 0x123456789abc]
+    assert obj.e.tolist() == [7, 8]
+    assert obj.dumps() == buf
+
+    obj.c = numpy.array([-1, 1])
+    assert c.test(obj.dumps()).c.tolist() == [-1, 1]
+
+
+def test_structure_dtype():
+    numpy = pytest.importorskip('numpy')
+
+    d = """
+    enum Color : uint16 {
+        RED = 1,
+        GREEN = 2,
+    };
+
+    struct point {
+        int16   x;
+        int16   y;
+    };
+
+    struct entry {
+        uint32  id;
+        Color   color;
+        point   pos[2];
+        char    name[4];
+        uint48  ref;
+        union {
+            uint32  raw;
+            uint16  half[2];
+        };
+    };
+
+    struct bits {
+        uint8   a:4;
+        uint8   b:4;
+    };
+    """
+    c = cstruct.cstruct(endian='>')
+    c.load(d)
+
+    dtype = cstruct.structure_dtype(c.entry)
+    assert dtype.itemsize == len(c.entry)
+    assert dtype.names == ('id', 'color', 'pos', 'name', 'ref', 'raw', 'half')
+    assert dtype.fields['raw'][1] == dtype.fields['half'][1]
+
+    buf = b''.join(
+        struct.pack('>IH4h4s', i, 2, 1, -1, i, -i, b'test') + (i + 1).to_bytes(6, 'big') + struct.pack('>I', 0x10002)
+        for i in range(3)
+    )
+    table = numpy.frombuffer(buf, dtype)
+    assert table['id'].tolist() == [0, 1, 2]
+    assert cstruct.wrap_enum(c.Color, table['color']) == [c.Color.GREEN] * 3
+    assert table['pos']['y'][:, 1].tolist() == [0, -1, -2]
+    assert table['name'].tolist() == [b'test'] * 3
+    assert c.uint48[3](table['ref'].tobytes()) == [1, 2, 3]
+    assert table['half'].tolist() == [[1, 2]] * 3
+
+    with pytest.raises(TypeError):
+        cstruct.structure_dtype(c.bits)
+
+
+def test_wrap_enum():
+    c = cstruct.cstruct()
+    c.load("""
+    flag Mode : uint8 {
+        R = 1,
+        W = 2,
+    };
+    """)
+
+    assert cstruct.wrap_enum(c.Mode, [1, 3]) == [c.Mode.R, c.Mode.R | c.Mode.W]
+    assert isinstance(cstruct.wrap_enum(c.Mode, [1])[0], cstruct.FlagInstance)
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_enum_shared_instances(compiled):
+    d = """
+    enum Color : uint16 {
+        RED = 1,
+        GREEN = 2,
+        BLUE = 1000,
+    };
+
+    struct test {
+        Color   a;
+        Color   b[2];
+        Color   c[];
+    };
+    """
+    c = cstruct.cstruct()
+    c.load(d, compiled=compiled)
+
+    assert c.Color(1) is c.Color.RED
+    assert c.Color(1000) is c.Color.BLUE
+    assert c.Color(3) is not c.Color(3)
+
+    obj = c.test(b'\x01\x00\x02\x00\xe8\x03\x01\x00\x00\x00')
+    assert obj.a is c.Color.RED
+    assert obj.b[0] is c.Color.GREEN
+    assert obj.b[1] is c.Color.BLUE
+    assert obj.c[0] is c.Color.RED
+
+    # Shared instances can't be modified
+    with pytest.raises(AttributeError):
+        obj.a.value = 2
+    with pytest.raises(AttributeError):
+        c.Color.RED.enum = None
+    assert c.Color.RED.value == 1
+    assert c.Color(1) is c.Color.RED
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_raw_enums(compiled):
+    d = """
+    enum Color : uint16 {
+        RED = 1,
+        GREEN = 2,
+    };
+
+    flag Mode : uint8 {
+        R = 1,
+        W = 2,
+    };
+
+    struct test {
+        Color   color;
+        Mode    mode;
+        Color   colors[2];
+        uint8   x;
+    };
+    """
+    c = cstruct.cstruct(raw_enums=True)
+    c.load(d, compiled=compiled)
+
+    buf = b'\x02\x00\x03\x01\x00\x02\x00\x07'
+    obj = c.test(buf)
+
+    assert obj.color is c.Color.GREEN
+    assert obj['color'] is c.Color.GREEN
+    assert obj.mode == c.Mode.R | c.Mode.W
+    assert obj.colors == [c.Color.RED, c.Color.GREEN]
+    assert obj.x == 7
+    raw = obj._raw_color if compiled else obj._raw_values['color']
+    assert raw == 2 and not isinstance(raw, cstruct.EnumInstance)
+
+    assert obj.dumps() == buf
+
+    obj.color = c.Color.RED
+    assert obj.color is c.Color.RED
+    assert obj.dumps() == b'\x01\x00' + buf[2:]
+
+
+def test_raw_enums_values():
+    d = """
+    enum Color : uint16 {
+        RED = 1,
+        GREEN = 2,
+    };
+
+    struct test {
+        Color   color;
+        Color   colors[2];
+        uint8   x;
+    };
+    """
+    buf = b'\x02\x00\x01\x00\x02\x00\x07'
+
+    results = []
+    for compiled in (True, False):
+        c = cstruct.cstruct(raw_enums=True)
+        c.load(d, compiled=compiled)
+        obj = c.test(buf)
+
+        assert obj._values['color'] is c.Color.GREEN
+        results.append((repr(obj), repr(list(obj._values.items())), dumpstruct(obj, output='string', color=False)))
+
+    # Both modes show the wrapped enum values
+    assert results[0] == results[1]
+    assert results[0][0] == '<test color=<Color.GREEN: 2>, colors=[<Color.RED: 1>, <Color.GREEN: 2>], x=0x7>'
+
+
+def test_flag_decompose(monkeypatch):
+    c = cstruct.cstruct()
+    c.load("""
+    flag Access : uint32 {
+        READ = 0x1,
+        WRITE = 0x2,
+        ALL = 0x3,
+        DELETE = 0x10000,
+    };
+    """)
+
+    assert c.Access(0x10003).decompose() == ([('WRITE', 2), ('READ', 1), ('DELETE', 0x10000), ('ALL', 3)], 0)
+    assert c.Access(0x10005).decompose() == ([('READ', 1), ('DELETE', 0x10000)], 4)
+    assert str(c.Access(0x10001)) == 'Access.READ|DELETE'
+    assert repr(c.Access(0x8)) == '<Access.8: 8>'
+
+    monkeypatch.setattr(cstruct.types.flag, 'DECOMPOSE_CACHE_SIZE', 2)
+    c.Access._decompositions.clear()
+    for value in range(4, 8):
+        c.Access(value).decompose()
+    assert list(c.Access._decompositions) == [6, 7]
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_pointer_cache(compiled):
+    d = """
+    struct node {
+        uint8   value;
+    };
+
+    struct pair {
+        node    *a;
+        node    *b;
+        node    *c;
+    };
+    """
+    c = cstruct.cstruct(pointer='uint8', pointer_cache=1)
+    c.load(d, compiled=compiled)
+
+    stream = BytesIO(b'\x03\x03\x04\x07\x08')
+    p = c.pair(stream)
+    assert p.a.value == 7
+    assert p.b._get() is p.a._get()
+    assert p.c.value == 8
+    assert len(c.cached_pointers(stream)) == 1
+    assert c.cached_pointers(stream).get(c.node, 3) is None
+    # The cache refers to the types themselves, so their ids can't be reused while cached
+    assert list(c.cached_pointers(stream)._values) == [(c.node, 4)]
+
+    p2 = c.pair(stream.getvalue())
+    assert p2.a._get() is not p.a._get()
+
+    c.pointer_cache_size = 0
+    assert c.cached_pointers(stream) is None
+
+
+class NonSeekableIO(object):
+    """File-like object that can only be read."""
+
+    def __init__(self, data):
+        self.fh = BytesIO(data)
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+    def close(self):
+        self.fh.close()
+
+
+def test_null_terminated_non_seekable():
+    c = cstruct.cstruct()
+    data = b''.join([
+        b'\x01abc\x00',
+        'hi\x00'.encode('utf-16-le'),
+        b'\x05\x00\x00\x00',
+        b'\x07\x00\x00\x00\x00\x00',
+        b'tail',
+    ])
+
+    r, w = os.pipe()
+    os.write(w, data)
+    os.close(w)
+
+    for fh in (open(r, 'rb', buffering=0), NonSeekableIO(data)):
+        assert c.char[None](fh) == b'\x01abc'
+        assert c.wchar[None](fh) == 'hi'
+        assert c.uint16[None](fh) == [5]
+        assert c.uint24[None](fh) == [7]
+        # Nothing is read past the terminators
+        assert fh.read(4) == b'tail'
+        fh.close()
+
+    with pytest.raises(EOFError):
+        c.char[None](NonSeekableIO(b'abc'))
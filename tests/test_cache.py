@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from dissect import cstruct
+from dissect.cstruct.parser import TokenParser
+
+
+DEFINITION = """
+#define SIZE 2
+
+enum Color : uint8 {
+    Red, Green, Blue
+};
+
+struct point {
+    uint16  x;
+    uint16  y;
+};
+
+struct test {
+    uint8   count;
+    Color   color;
+    point   points[count];
+    char    name[SIZE];
+    uint32  flags:4;
+    uint32  rest:28;
+};
+"""
+
+
+def _fail_parse(self, data):
+    raise AssertionError("Definitions were parsed instead of loaded from the cache")
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_cache_roundtrip(tmp_path, monkeypatch, compiled):
+    buf = b'\x02\x01\x01\x00\x02\x00\x03\x00\x04\x00ab\x21\x00\x00\x00'
+
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.load(DEFINITION, compiled=compiled)
+    assert len(os.listdir(tmp_path)) == 1
+    expected = c.test(buf)
+
+    monkeypatch.setattr(TokenParser, 'parse', _fail_parse)
+
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.load(DEFINITION, compiled=compiled)
+
+    assert c.SIZE == 2
+    assert c.Color.Blue == 2
+    assert ('+compiled' in repr(c.test)) == compiled
+    if compiled:
+        assert c.test.source == expected._type.source
+
+    obj = c.test(buf)
+    assert repr(obj) == repr(expected)
+    assert obj._sizes == expected._sizes
+    assert obj.color == c.Color.Green
+    assert obj.dumps() == buf
+
+    # Compiled types loaded from the cache follow endianness changes as well
+    c.endian = '>'
+    assert c.test(buf).points[0].x == 0x100
+
+
+def test_cache_key(tmp_path):
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.load(DEFINITION)
+
+    cstruct.cstruct(cache_dir=str(tmp_path)).load(DEFINITION, compiled=False)
+    cstruct.cstruct(endian='>', cache_dir=str(tmp_path)).load(DEFINITION)
+    cstruct.cstruct(cache_dir=str(tmp_path)).load(DEFINITION + 'struct other { uint8 a; };')
+    assert len(os.listdir(tmp_path)) == 4
+
+    # The state of the instance is part of the key, loading on top of other definitions is a miss
+    c.load(DEFINITION.replace('test', 'test2').replace('point', 'point2').replace('Color', 'Color2'))
+    assert len(os.listdir(tmp_path)) == 5
+
+    # Redefining an existing typedef is a miss as well
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.addtype('word', c.uint16)
+    c.load("struct s { word a; uint8 b; };")
+
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.addtype('word', c.uint32)
+    c.load("struct s { word a; uint8 b; };")
+    assert c.s(b'\x01\x02\x03\x04\x05').a == 0x4030201
+    assert len(os.listdir(tmp_path)) == 7
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="Requires file ownership")
+def test_cache_untrusted_dir(tmp_path):
+    cstruct.cstruct(cache_dir=str(tmp_path)).load(DEFINITION)
+    assert len(os.listdir(tmp_path)) == 1
+
+    os.chmod(tmp_path, 0o777)
+    try:
+        c = cstruct.cstruct(cache_dir=str(tmp_path))
+        with pytest.warns(UserWarning):
+            c.load(DEFINITION.replace('test', 'test2'))
+        assert 'test2' in c.typedefs
+        assert len(os.listdir(tmp_path)) == 1
+    finally:
+        os.chmod(tmp_path, 0o700)
+
+
+def test_cache_corrupt(tmp_path):
+    cstruct.cstruct(cache_dir=str(tmp_path)).load(DEFINITION)
+
+    for name in os.listdir(tmp_path):
+        with open(os.path.join(tmp_path, name), 'wb') as fh:
+            fh.write(b'garbage')
+
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.load(DEFINITION)
+    assert c.point(b'\x01\x00\x02\x00').y == 2
+
+    c = cstruct.cstruct(cache_dir=str(tmp_path))
+    c.load(DEFINITION)
+    assert c.point(b'\x01\x00\x02\x00').y == 2
@@ -1,3 +1,5 @@
+import timeit
+
 import pytest
 
 from dissect.cstruct.expression import Expression
@@ -44,10 +46,20 @@ testdata = [
     ('0 | 1', 1),
     ('1 | 1', 1),
     ('1 | 2', 3),
-    # This type of expression is not supported by the parser and will fail.
-    # ('4 * 1 + 1', 5),
+    ('4 * 1 + 1', 5),
+    ('1 + 2 * 3', 7),
+    ('(1 + 2) * 3', 9),
+    ('1 << 2 + 1', 8),
+    ('1 | 2 ^ 3 & 4', 3),
+    ('10 - 4 - 3', 3),
+    ('16 / 4 / 2', 2),
     ('-42', -42),
     ('42 + (-42)', 0),
+    ('42 + -42', 0),
+    ('2 * -3', -6),
+    ('-(1 + 2)', -3),
+    ('~0 & 0xff', 0xff),
+    ('--1', 1),
     ('A + 5', 13),
     ('21 - B', 8),
     ('A + B', 21),
@@ -72,3 +84,121 @@ def id_fn(val):
 def test_expression(expression, answer):
     parser = Expression(Consts(), expression)
     assert parser.evaluate() == answer
+
+
+@pytest.mark.parametrize('expression, answer',
+                         testdata,
+                         ids=id_fn)
+def test_expression_translate(expression, answer):
+    parser = Expression(Consts(), expression)
+    assert eval(parser.translate(lambda name: None)) == answer
+
+
+def test_expression_translate_context():
+    parser = Expression(Consts(), 'flag & (A << 1) * x')
+    code = parser.translate(lambda name: 'ctx["{}"]'.format(name) if name in ('flag', 'x') else None)
+
+    assert code == '(ctx["flag"] & ((8 << 1) * ctx["x"]))'
+    assert eval(code, {'ctx': {'flag': 0x10, 'x': 2}}) == parser.evaluate({'flag': 0x10, 'x': 2})
+
+    with pytest.raises(ValueError):
+        Expression(Consts(), 'unknown + 1').translate(lambda name: None)
+
+
+@pytest.mark.parametrize('expression', ['1 +', '(1 + 2', '1 + 2)', '1 $ 2', '* 2'])
+def test_expression_invalid(expression):
+    with pytest.raises(ValueError):
+        Expression(Consts(), expression).evaluate()
+
+
+def test_expression_context():
+    parser = Expression(Consts(), 'A + a * 2')
+
+    assert parser.evaluate({'a': 1}) == 10
+    assert parser.evaluate({'a': 2}) == 12
+    # Names in the context take precedence over constants
+    assert parser.evaluate({'a': 2, 'A': 0}) == 4
+
+    with pytest.raises(KeyError):
+        parser.evaluate()
+
+
+class LegacyExpression(object):
+    """The previous string splitting expression evaluator, used as benchmark reference."""
+
+    operators = [
+        ('*', lambda a, b: a * b),
+        ('/', lambda a, b: a // b),
+        ('%', lambda a, b: a % b),
+        ('+', lambda a, b: a + b),
+        ('-', lambda a, b: a - b),
+        ('>>', lambda a, b: a >> b),
+        ('<<', lambda a, b: a << b),
+        ('&', lambda a, b: a & b),
+        ('^', lambda a, b: a ^ b),
+        ('|', lambda a, b: a | b),
+    ]
+
+    def __init__(self, cstruct, expression):
+        self.cstruct = cstruct
+        self.expression = expression
+
+    def evaluate(self, context={}):
+        levels = []
+        buf = ''
+
+        for i in range(len(self.expression)):
+            if self.expression[i] == '(':
+                levels.append(buf)
+                buf = ''
+                continue
+
+            if self.expression[i] == ')':
+                value = self.evaluate_part(buf, context)
+                buf = levels.pop()
+                buf += str(value)
+                continue
+
+            buf += self.expression[i]
+
+        return self.evaluate_part(buf, context)
+
+    def evaluate_part(self, buf, context):
+        buf = buf.strip()
+
+        if buf.startswith('-') and buf[1:].isnumeric():
+            return int(buf)
+
+        for operator in self.operators:
+            if operator[0] in buf:
+                a, b = buf.rsplit(operator[0], 1)
+
+                return operator[1](
+                    self.evaluate_part(a, context),
+                    self.evaluate_part(b, context)
+                )
+
+        if buf in context:
+            return context[buf]
+
+        if buf.startswith('0x'):
+            return int(buf, 16)
+
+        if buf in self.cstruct.consts:
+            return self.cstruct.consts[buf]
+
+        return int(buf)
+
+
+def test_expression_benchmark():
+    context = {'size': 0x20, 'flags': 0x3}
+    expression = '(size * 2) + (flags & 0x1) + (A << 1)'
+
+    legacy = LegacyExpression(Consts(), expression)
+    parser = Expression(Consts(), expression)
+    assert parser.evaluate(context) == legacy.evaluate(context) == 0x51
+
+    legacy_time = min(timeit.repeat(lambda: legacy.evaluate(context), number=1000, repeat=3))
+    parser_time = min(timeit.repeat(lambda: parser.evaluate(context), number=1000, repeat=3))
+
+    assert parser_time < legacy_time
@@ -0,0 +1,137 @@
+import struct
+from io import BytesIO
+
+import pytest
+
+from dissect import cstruct
+
+
+DEFINITION = """
+struct LIST_ENTRY {
+    void    *Flink;
+    void    *Blink;
+};
+
+struct item {
+    uint16      value;
+    LIST_ENTRY  entry;
+};
+
+struct head {
+    LIST_ENTRY  entry;
+};
+
+struct tree {
+    uint16  value;
+    uint16  left;
+    uint16  right;
+};
+"""
+
+
+class CountingIO(BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_traverse_list(compiled):
+    c = cstruct.cstruct(pointer='uint16')
+    c.load(DEFINITION, compiled=compiled)
+
+    # A circular list with a head at 0 and items at 0x10, 0x20 and 0x30, in reverse order
+    order = [0x30, 0x10, 0x20]
+    links = [0] + order + [0]
+    data = bytearray(0x40)
+    struct.pack_into('<HH', data, 0, order[0] + 2, order[-1] + 2)
+    for i, addr in enumerate(order, 1):
+        struct.pack_into('<HHH', data, addr, i, links[i + 1] + (2 if links[i + 1] else 0), links[i - 1] + 2)
+
+    fh = CountingIO(bytes(data))
+    head = c.head(fh)
+    fh.seek(4)
+    fh.reads = 0
+
+    items = list(cstruct.traverse(head, 'entry.Flink', type_=c.item, offset=2, addr=0))
+    assert [item.value for item in items] == [1, 2, 3]
+    assert fh.reads == 3
+    assert fh.tell() == 4
+
+    # Following both links reads every item once
+    items = list(cstruct.traverse(head, ['entry.Flink', 'entry.Blink'], type_=c.item, offset=2, addr=0))
+    assert sorted(item.value for item in items) == [1, 2, 3]
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_traverse_tree(compiled):
+    c = cstruct.cstruct()
+    c.load(DEFINITION, compiled=compiled)
+
+    # A tree with 1 at the root, 2 and 3 as its children, and a cycle back to the root from 3
+    nodes = {0: (1, 6, 12), 6: (2, 0, 0), 12: (3, 0, 0)}
+    data = b''.join(struct.pack('<3H', *nodes[addr]) for addr in sorted(nodes))
+    data = data[:-2] + struct.pack('<H', 0)
+    fh = CountingIO(data)
+
+    root = c.tree(fh)
+    fh.reads = 0
+    assert [node.value for node in cstruct.traverse(root, ('left', 'right'), source=fh, addr=0)] == [2, 3]
+    # Both children are read with a single read
+    assert fh.reads == 1
+
+    fh.reads = 0
+    nodes = list(cstruct.traverse(root, ('left', 'right'), source=fh, addr=0, gap=0))
+    assert [node.value for node in nodes] == [2, 3]
+    assert fh.reads == 1
+
+    nodes = list(cstruct.traverse(root, ('left', 'right'), source=fh, addr=0, batch_size=1, gap=0))
+    assert [node.value for node in nodes] == [2, 3]
+
+    with pytest.raises(ValueError):
+        list(cstruct.traverse(root, 'left'))
+
+
+class StrictAddressSpace(cstruct.AddressSpace):
+    """Address space that refuses reads that touch an unmapped page."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def read(self, addr, size):
+        result = b''
+        while size:
+            page = self.pages.get(addr & ~0xfff)
+            if page is None:
+                raise cstruct.AddressError("Address not mapped: 0x%x" % addr)
+
+            chunk = page[addr & 0xfff:(addr & 0xfff) + size]
+            result += chunk
+            addr += len(chunk)
+            size -= len(chunk)
+
+        return result
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_traverse_unmapped_gap(compiled):
+    c = cstruct.cstruct()
+    c.load(DEFINITION, compiled=compiled)
+
+    # Two nodes within the gap of each other, with the unmapped page 0x2000 between them
+    low = bytearray(0x1000)
+    struct.pack_into('<3H', low, 0xffa, 2, 0, 0)
+    high = struct.pack('<3H', 3, 0, 0).ljust(0x1000, b'\x00')
+    root = c.tree(struct.pack('<3H', 1, 0x1ffa, 0x3000))
+
+    image = BytesIO(bytes(low) + high)
+    paged = cstruct.PagedAddressSpace(image, {0x1000: 0, 0x3000: 0x1000}.get)
+    strict = StrictAddressSpace({0x1000: bytes(low), 0x3000: high})
+
+    for space in (paged, strict):
+        nodes = list(cstruct.traverse(root, ('left', 'right'), source=space))
+        assert [node.value for node in nodes] == [2, 3]